@@ -1,24 +1,37 @@
 from utils import *
+import json
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 import pandas as pd
-import mplfinance as mpf
-import matplotlib.pyplot as plt
 from DataManager import DataManager
+from Metrics import trade_metrics, breakdown
+from Indicators import bollinger_indicators
+
+# The indicator columns _plot_tckr draws
+PLOT_COLUMNS = ('Bollinger High', 'Bollinger Low', 'ma', 'perc_b', 'Intensity', 'BandWidth', 'BandWidth High',
+                'BandWidth Low', 'Trend')
 
 
 class Analyzer:
     """
     This class is used to analyze the strategy.
     """
-    def __init__(self, strat):
+    def __init__(self, strat, run=True):
         """
         strat must be an instance of the strategy class. See bringAllTogether.py.
+        :param run: Run the strategy, False if it has already been run
         """
         self.strat = strat
-        # Runs the strategy, creates all the signals and the trades
-        self.strat.run()
+        if run:
+            # Runs the strategy, creates all the signals and the trades
+            self.strat.run()
         self.losers = None
         self.winners = None
+        self.metrics = None
+        self.symbol_metrics = None
+        self.sector_metrics = None
         self.total_returns = self.get_returns()
 
     def get_returns(self):
@@ -35,11 +48,22 @@ class Analyzer:
         self.losers = self._get_ends(best=False)
         self.winners = self._get_ends(best=True)
 
+    def get_metrics(self, sectors=None):
+        """
+        Sharpe, Sortino, drawdown, win rate etc. of the strategy, see Metrics.trade_metrics
+        :param sectors: {symbol: sector} to also get the metrics of each sector in self.sector_metrics
+        """
+        self.metrics = trade_metrics(self.strat.ledger, symbols=len(self.strat.portfolio))
+        self.symbol_metrics = breakdown(self.strat.ledger)
+        if sectors is not None:
+            self.sector_metrics = breakdown(self.strat.ledger, sectors)
+        return self.metrics
+
     def get_sharpe(self):
         """
-        Eventually will calculate the sharpe ratio of the strategy
+        Annualised Sharpe ratio of the strategy, from the returns of the trades on their close dates
         """
-        print("Not implemented yet")
+        return trade_metrics(self.strat.ledger)['sharpe']
 
     def _get_ends(self, best=True):
         """
@@ -51,18 +75,27 @@ class Analyzer:
             end = self.strat.rets_df[self.strat.rets_df['return'] < 0].sort_values(by='return', ascending=True)
         return end
 
-    def analyze(self):
+    def analyze(self, interactive=True):
         """
         The big function of this class, run this to get a deep analyse, with option to plot different symbols
+        :param interactive: False to only print the summary and skip asking which stocks to plot
         """
         self.get_returns()
         self.get_losers_winners()
         print("\n\n")
         print("Total Cumulative Returns: {}%".format(round(self.total_returns, 2)*100))
+        self.get_metrics()
+        print("Sharpe: {:.2f}  Sortino: {:.2f}  Max Drawdown: {:.1f}% over {} days".format(
+            self.metrics['sharpe'], self.metrics['sortino'], 100 * self.metrics['max_drawdown'],
+            self.metrics['drawdown_duration']))
+        print("Win Rate: {:.1f}%  Profit Factor: {:.2f}  Average Days Held: {:.1f}".format(
+            100 * self.metrics['win_rate'], self.metrics['profit_factor'], self.metrics['avg_days_held']))
         print("The 5 biggest losers were: \n")
         print(self.losers.head(n=5))
         print("The 5 biggest winners were: \n")
         print(self.winners.head(n=5))
+        if not interactive:
+            return
 
         while True:
             print("\n\n")
@@ -81,45 +114,77 @@ class Analyzer:
             else:
                 print("Sorry, did not recognise this request")
 
-    def plot_tckr(self, tckr='APA'):
+    def _plot_data(self, tckr):
+        """
+        The ticker's data with every column the plot draws. Lean data (see DataManager.prepare_data) only has the
+        indicators the strategy trades on, the rest are worked out here for this ticker with the same settings
+        """
         stock = self.strat.portfolio[tckr]
-        if 'date' in stock.columns:
-            stock.index = pd.to_datetime(stock['date'])
-            del stock['date']
-        stock_trans = self.strat.trans_df[self.strat.trans_df['symbol'] == tckr]
-        if 'date' in stock_trans.columns:
-            stock_trans.index = pd.to_datetime(stock_trans['date'])
-        longs = stock_trans[(stock_trans['direction'] == 1) & (stock_trans['close'] == 0)]['price'].rename('price_longs')
-        shorts = stock_trans[(stock_trans['direction'] == -1) & (stock_trans['close'] == 0)]['price'].rename('price_shorts')
-        close = stock_trans[stock_trans['close'] != 0]['price'].rename('price_close')
-
-        ap = [mpf.make_addplot(stock['Bollinger High'], color='b'), mpf.make_addplot(stock['Bollinger Low'], color='b'),
-              mpf.make_addplot(stock['ma'], color='g'),
-              mpf.make_addplot(stock['perc_b'], ylabel='perc_b', panel=1),
-              mpf.make_addplot(np.ones(len(stock['perc_b'])), color='g', panel=1),
-              mpf.make_addplot(np.zeros(len(stock['perc_b'])), color='g', secondary_y=False, panel=1),
-              mpf.make_addplot(stock['Intensity'], ylabel='Volume', type='bar', panel=2),
-              mpf.make_addplot(stock['BandWidth'], ylabel='BandWidth', panel=3),
-              mpf.make_addplot(stock['BandWidth High'], panel=3),
-              mpf.make_addplot(stock['BandWidth Low'], panel=3),
-              mpf.make_addplot(stock['Trend'], ylabel='Trend', panel=4)]
-
-        if len(longs) != 0:
-            stock = stock.merge(longs, how='left', left_index=True, right_index=True, suffixes=('', '_longs'))
-            ap.append(mpf.make_addplot(stock['price_longs'], type='scatter', marker='^', color='g', markersize=100))
-        if len(shorts) != 0:
-            stock = stock.merge(shorts, how='left', left_index=True, right_index=True, suffixes=('', '_shorts'))
-            ap.append(mpf.make_addplot(stock['price_shorts'], type='scatter', marker='v', color='g', markersize=100))
-        if len(close) != 0:
-            stock = stock.merge(close, how='left', left_index=True, right_index=True, suffixes=('', '_close'))
-            ap.append(mpf.make_addplot(stock['price_close'], type='scatter', marker='^', color='r', markersize=100))
-        mpf.plot(stock, type='candle', addplot=ap, title=tckr)
+        missing = [column for column in PLOT_COLUMNS if column not in stock.columns]
+        if not missing:
+            return stock
+        key = stock.attrs.get('indicators')
+        if key is None or key[0] != 'bollinger':
+            raise ValueError("{} doesn't have the columns to plot: {}".format(tckr, ', '.join(missing)))
+        _, window, width, bandwidth_window = key
+        ind = bollinger_indicators(stock['close'].values, stock['high'].values, stock['low'].values,
+                                   stock['volume'].values, window, width, bandwidth_window, columns=missing)
+        # Added to a shallow copy so the strategy's data stays lean
+        stock = stock.copy(deep=False)
+        for column, values in ind.items():
+            stock[column] = values[:, 0]
+        return stock
+
+    def plot_tckr(self, tckr='APA'):
+        import matplotlib.pyplot as plt
+        _plot_tckr(self._plot_data(tckr), self.strat.trans_df[self.strat.trans_df['symbol'] == tckr], tckr)
         plt.show()
 
+    def render_plots(self, tickers, folder, workers=2):
+        """
+        Saves the plot of each ticker to folder/<tckr>.png without showing anything. The plots are drawn in a pool
+        of processes with the Agg backend, so this works without a display and matplotlib is never loaded here
+        :return: {tckr: path of the png}
+        """
+        os.makedirs(folder, exist_ok=True)
+        trans_df = self.strat.trans_df
+        paths = {tckr: os.path.join(folder, '{}.png'.format(tckr)) for tckr in tickers}
+        with ProcessPoolExecutor(max_workers=max(1, min(workers, len(paths)))) as executor:
+            futures = [executor.submit(_render_plot, self._plot_data(tckr), trans_df[trans_df['symbol'] == tckr],
+                                       tckr, path) for tckr, path in paths.items()]
+            for future in futures:
+                future.result()
+        return paths
+
+    def report(self, path=None, plot_tickers=None, plot_folder=None, workers=2, sectors=None):
+        """
+        The non interactive version of analyze for batch jobs: works out the results without printing or plotting
+        anything unless asked to
+        :param path: Where to write the results as json, None to not write them
+        :param plot_tickers: Tickers to save plots of, see render_plots
+        :param plot_folder: Where to save the plots, defaults to a plots folder next to path
+        :param sectors: {symbol: sector} to break the metrics down by sector as well
+        :return: AnalysisResult
+        """
+        self.get_returns()
+        self.get_losers_winners()
+        self.get_metrics(sectors)
+        plots = {}
+        if plot_tickers:
+            if plot_folder is None:
+                plot_folder = os.path.join(os.path.dirname(path) if path else '.', 'plots')
+            plots = self.render_plots(plot_tickers, plot_folder, workers)
+        result = AnalysisResult(self.total_returns, self.metrics, self.symbol_metrics, self.sector_metrics,
+                                self.winners.head(n=5), self.losers.head(n=5), plots)
+        if path is not None:
+            result.save(path)
+        return result
+
     def plot_returns(self):
         """
         Still in production, not completed.
         """
+        import matplotlib.pyplot as plt
         sorted_rets = self.strat.rets_df.sort_values(by='close_date')
         sorted_rets.index = pd.to_datetime(sorted_rets['close_date'])
         del sorted_rets['close_date']
@@ -130,3 +195,92 @@ class Analyzer:
 
 
 
+
+
+class AnalysisResult:
+    """
+    The results of Analyzer.report, everything as plain values so it can be saved as json
+    """
+    def __init__(self, total_returns, metrics, symbol_metrics, sector_metrics, winners, losers, plots):
+        self.total_returns = total_returns
+        self.metrics = metrics
+        self.symbol_metrics = symbol_metrics
+        self.sector_metrics = sector_metrics
+        self.winners = winners
+        self.losers = losers
+        self.plots = plots
+
+    def to_dict(self):
+        def clean(value):
+            # json has no nan or inf
+            if isinstance(value, dict):
+                return {str(key): clean(item) for key, item in value.items()}
+            if isinstance(value, list):
+                return [clean(item) for item in value]
+            if isinstance(value, (np.integer, np.bool_)):
+                return value.item()
+            if isinstance(value, (float, np.floating)):
+                return float(value) if math.isfinite(value) else None
+            return value
+
+        def records(df):
+            return None if df is None else df.reset_index().to_dict(orient='records')
+
+        return clean({'total_returns': self.total_returns, 'metrics': self.metrics,
+                      'symbol_metrics': records(self.symbol_metrics), 'sector_metrics': records(self.sector_metrics),
+                      'winners': records(self.winners), 'losers': records(self.losers), 'plots': self.plots})
+
+    def save(self, path):
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+
+def _plot_tckr(stock, stock_trans, tckr, savefig=None):
+    """
+    Candle chart of a ticker with its indicators and trades
+    """
+    import mplfinance as mpf
+    if 'date' in stock.columns:
+        stock = stock.set_index(pd.to_datetime(stock['date'])).drop(columns='date')
+    if 'date' in stock_trans.columns:
+        stock_trans = stock_trans.set_index(pd.to_datetime(stock_trans['date']))
+    longs = stock_trans[(stock_trans['direction'] == 1) & (stock_trans['close'] == 0)]['price'].rename('price_longs')
+    shorts = stock_trans[(stock_trans['direction'] == -1) & (stock_trans['close'] == 0)]['price'].rename('price_shorts')
+    close = stock_trans[stock_trans['close'] != 0]['price'].rename('price_close')
+
+    ap = [mpf.make_addplot(stock['Bollinger High'], color='b'), mpf.make_addplot(stock['Bollinger Low'], color='b'),
+          mpf.make_addplot(stock['ma'], color='g'),
+          mpf.make_addplot(stock['perc_b'], ylabel='perc_b', panel=1),
+          mpf.make_addplot(np.ones(len(stock['perc_b'])), color='g', panel=1),
+          mpf.make_addplot(np.zeros(len(stock['perc_b'])), color='g', secondary_y=False, panel=1),
+          mpf.make_addplot(stock['Intensity'], ylabel='Volume', type='bar', panel=2),
+          mpf.make_addplot(stock['BandWidth'], ylabel='BandWidth', panel=3),
+          mpf.make_addplot(stock['BandWidth High'], panel=3),
+          mpf.make_addplot(stock['BandWidth Low'], panel=3),
+          mpf.make_addplot(stock['Trend'], ylabel='Trend', panel=4)]
+
+    if len(longs) != 0:
+        stock = stock.merge(longs, how='left', left_index=True, right_index=True, suffixes=('', '_longs'))
+        ap.append(mpf.make_addplot(stock['price_longs'], type='scatter', marker='^', color='g', markersize=100))
+    if len(shorts) != 0:
+        stock = stock.merge(shorts, how='left', left_index=True, right_index=True, suffixes=('', '_shorts'))
+        ap.append(mpf.make_addplot(stock['price_shorts'], type='scatter', marker='v', color='g', markersize=100))
+    if len(close) != 0:
+        stock = stock.merge(close, how='left', left_index=True, right_index=True, suffixes=('', '_close'))
+        ap.append(mpf.make_addplot(stock['price_close'], type='scatter', marker='^', color='r', markersize=100))
+    if savefig is None:
+        mpf.plot(stock, type='candle', addplot=ap, title=tckr)
+    else:
+        mpf.plot(stock, type='candle', addplot=ap, title=tckr, savefig=savefig)
+
+
+def _render_plot(stock, stock_trans, tckr, path):
+    """
+    Runs in the render_plots pool, saves the plot without needing a display
+    """
+    import matplotlib
+    matplotlib.use('Agg')
+    _plot_tckr(stock, stock_trans, tckr, savefig=path)
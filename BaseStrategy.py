@@ -1,27 +1,80 @@
 from utils import *
 import pandas as pd
+from SignalEngine import run_signals
+from TradeLedger import TradeLedger
+from Instrumentation import current_report
+import numpy as np
+
+
+class _BarFrame:
+    """
+    One bar that looks enough like a one row DataFrame for _entry_conditions/_exit_conditions, which only use
+    data[column].values. Building a real DataFrame for every bar costs more than the rest of update put together
+    """
+    def __init__(self, row):
+        self.row = row
+
+    def __getitem__(self, column):
+        return _BarColumn(self.row[column])
+
+
+class _BarColumn:
+    def __init__(self, value):
+        self.values = np.array([value])
 
 
 class BaseStrategy:
     """
     This is the parent to all strategies that will be created and has the fundamental necessary properties of any
     strategy. i.e. buy long, buy short, close position, transaction dataframes and return dataframes
+    Strategies keep their portfolio as an overlay of the one they are given (see utils.overlay) so the indicator
+    and signal columns never end up in the caller's data. Building a strategy on another strategy's portfolio
+    reuses its indicators.
     """
+    # Names of the params which change the indicators, None if unknown. Used by the Optimizer to reuse indicators
+    indicator_params = None
+    # Names of the indicator columns the strategy reads, None for all of them. Lean data only gets these
+    required_columns = None
+    # The variables describing the open position of a ticker, update keeps a set of them per ticker
+    position_vars = ('open_pos', 'entry_price', 'target_price', 'stop_price', 'entry_date', 'close_price')
+
     def __init__(self):
         """
 
         """
-        self.rets_df = pd.DataFrame(columns=['symbol', 'entry_date', 'close_date', 'days_held', 'direction',
-                                             'entry_price', 'close_price', 'return'])
-        self.trans_df = pd.DataFrame(columns=['symbol', 'date', 'direction', 'close', 'price'])
+        # Every transaction and the return of every closed trade, see trans_df and rets_df
+        self.ledger = TradeLedger()
         # This can be overwritten in the actual strategy
         self.stop_loss_perc = 0.1
+        # Strategies with a stop loss set this to True, run then closes positions that cross stop_price
+        self.use_stop_loss = False
+        # Print a warning for tickers that finish the run with a position still open
+        self.warn_still_open = False
         self.open_pos = None
         self.entry_price = None
         self.target_price = None
         self.stop_price = None
         self.entry_date = None
         self.close_price = None
+        # State of each ticker run bar by bar with update
+        self._live = {}
+        # Checkpoint.Checkpoint to save progress to, None to not save any
+        self.checkpoint = None
+
+    @property
+    def trans_df(self):
+        """
+        DataFrame of every transaction: symbol, date, direction, close (1 if it closed a position) and price
+        """
+        return self.ledger.trans_df
+
+    @property
+    def rets_df(self):
+        """
+        DataFrame of every closed trade: symbol, entry_date, close_date, days_held, direction, entry_price,
+        close_price and return
+        """
+        return self.ledger.rets_df
 
     def _reset_vars(self):
         self.entry_price = None
@@ -42,28 +95,179 @@ class BaseStrategy:
         self.entry_date = row['date']
         self.entry_price = row['next_open']
         self.stop_price = (1-direction*self.stop_loss_perc)*self.entry_price
-        self.trans_df = self.trans_df.append(
-            {'symbol': tckr, 'date': self.entry_date, 'direction': direction, 'close': 0, 'price': self.entry_price},
-            ignore_index=True)
+        self.ledger.add_transaction(tckr, self.entry_date, direction, 0, self.entry_price)
 
     def _close_pos(self, tckr, row):
         close_date = row['date']
         close_price = row['next_open']
         returns = (close_price / self.entry_price - 1) * self.open_pos
-        days_held = calc_diff(self.entry_date, close_date, type='days')
-        self.trans_df = self.trans_df.append(
-            {'symbol': tckr, 'date': close_date, 'direction': self.open_pos, 'close': 1, 'price': close_price},
-            ignore_index=True)
-        self.rets_df = self.rets_df.append({'symbol': tckr, 'entry_date': self.entry_date, 'close_date': close_date,
-                                            'days_held': days_held, 'direction': self.open_pos,
-                                            'entry_price': self.entry_price, 'close_price': close_price,
-                                            'return': returns}, ignore_index=True)
+        self.ledger.add_transaction(tckr, close_date, self.open_pos, 1, close_price)
+        # days_held is worked out for all the trades at once by the ledger
+        self.ledger.add_return(tckr, self.entry_date, close_date, self.open_pos, self.entry_price, close_price,
+                               returns)
         # reset Variables
         self._reset_vars()
 
-    def run(self):
-        # This should include
-        print("Make sure you include a run function in the Strategy class")
+    def _entry_conditions(self, data):
+        """
+        The conditions to open a position, this is what a strategy has to declare.
+        :return: (long, short) boolean arrays over the rows of data. Short is checked first when both are true
+        """
+        print("Make sure you include an _entry_conditions function in the Strategy class")
+
+    def _exit_conditions(self, data):
+        """
+        The conditions to close the open position, the stop loss (if use_stop_loss) is checked on top of these.
+        :return: boolean array over the rows of data
+        """
+        print("Make sure you include an _exit_conditions function in the Strategy class")
+
+    def _signals(self, data):
+        """
+        Runs the entry/exit conditions of the strategy over every row of data through SignalEngine.run_signals
+        :return: open_signal, close_signal, trades as run_signals, or None if the strategy has no conditions
+        """
+        entries = self._entry_conditions(data)
+        exit_signal = self._exit_conditions(data)
+        if entries is None or exit_signal is None:
+            return None
+        return run_signals(entries[0], entries[1], exit_signal, data['close'].values, data['next_open'].values,
+                           stop_loss_perc=self.stop_loss_perc if self.use_stop_loss else None)
+
+    def run(self, checkpoint=None):
+        """
+        Runs the strategy on every ticker, creating the open/close signals and the trades. The strategy's
+        _entry_conditions and _exit_conditions are evaluated for all rows at once and then SignalEngine.run_signals
+        works out which of them actually trade.
+        :param checkpoint: Checkpoint.Checkpoint to save the progress to (defaults to self.checkpoint). If it has a
+                           snapshot of this run the tickers already done are skipped
+        """
+        checkpoint = checkpoint if checkpoint is not None else self.checkpoint
+        # Running again starts from scratch rather than adding the same trades twice
+        self.ledger = TradeLedger()
+        done = []
+        if checkpoint is not None:
+            done = checkpoint.restore(self)
+            # Rewritten when the saved ones are of other data or settings, so they never go stale
+            if not checkpoint.has_indicators(self.portfolio):
+                checkpoint.save_indicators(self.portfolio)
+        finished = set(done)
+        report = current_report()
+        for tckr, data in self.portfolio.items():
+            if tckr in finished:
+                continue
+            self._reset_vars()
+            with report.stage('run', tckr):
+                signals = self._signals(data)
+                if signals is None:
+                    return
+                open_signal, close_signal, trades = signals
+                dates = data['date'].values
+                next_open = data['next_open'].values
+                for opened, closed, direction in trades:
+                    self._open_pos(tckr, {'date': dates[opened], 'next_open': next_open[opened]}, int(direction))
+                    if closed is not None:
+                        self._close_pos(tckr, {'date': dates[closed], 'next_open': next_open[closed]})
+            report.count('tickers_run')
+            report.count('rows_processed', len(data))
+            report.count('trades_opened', len(trades))
+            report.count('trades_closed', sum(closed is not None for _, closed, _ in trades))
+            if self.open_pos is not None and self.warn_still_open:
+                # Eventually need to do something about this
+                print("Position is still open")
+            set_column(data, 'open_signal', open_signal)
+            set_column(data, 'close_signal', close_signal)
+            if checkpoint is not None:
+                done.append(tckr)
+                checkpoint.completed(self, done)
+        if checkpoint is not None:
+            # Marked as finished so a later run doesn't pick up from it
+            checkpoint.save(self, done, finished=True)
+
+    def _indicator_state(self):
+        """
+        The bar by bar version of add_indicators, a strategy has to declare this to use update. Should return an
+        object with update(close, high, low, volume) giving the indicators of the new bar as a dict, feed(...) for a
+        run of bars and warmup, the number of bars of history it needs. See Indicators.BollingerState
+        """
+        print("Make sure you include an _indicator_state function in the Strategy class to use update")
+
+    def _start_live(self, tckr):
+        """
+        Sets up a ticker for update. If the ticker is in the portfolio the indicator state is fed the end of its
+        history and the position it finishes with (worked out with the vectorised engine) is carried over, so update
+        carries on where the history stops. Trades in the history aren't added to the ledger, that is what run is for.
+        """
+        state = self._indicator_state()
+        if state is None:
+            return None
+        live = {'state': state, 'pending': None}
+        live.update({var: None for var in self.position_vars})
+        data = self.portfolio.get(tckr) if self.portfolio is not None else None
+        if data is not None and len(data):
+            tail = data.iloc[-state.warmup:]
+            state.feed(tail['close'].values, tail['high'].values, tail['low'].values, tail['volume'].values)
+            signals = self._signals(data)
+            if signals is not None and signals[2]:
+                opened, closed, direction = signals[2][-1]
+                dates = data['date'].values
+                next_open = data['next_open'].values
+                last = len(data) - 1
+                if closed is None and opened == last:
+                    # Signalled on the last bar of history, it fills at the open of the first new bar
+                    live['pending'] = (int(direction), dates[opened])
+                elif closed is None or closed == last:
+                    live['open_pos'] = int(direction)
+                    live['entry_date'] = dates[opened]
+                    live['entry_price'] = next_open[opened]
+                    live['stop_price'] = (1 - direction * self.stop_loss_perc) * next_open[opened]
+                    if closed is not None:
+                        live['pending'] = ('close', dates[closed])
+        self._live[tckr] = live
+        return live
+
+    def update(self, tckr, bar):
+        """
+        Runs the strategy on one new bar of a ticker, without recomputing anything over the history. Orders work
+        like run: a signal on a bar fills at the next bar's open and is recorded under the signal's date, so a signal
+        is only traded once the following bar arrives. Trades go in the ledger like the ones from run.
+        :param tckr: The ticker, if it is in the portfolio the first update carries on from the end of its history
+        :param bar: dict (or Series) with the date, open, high, low, close and volume of the bar
+        :return: dict of the bar's indicators plus its open_signal and close_signal
+        """
+        live = self._live.get(tckr)
+        if live is None:
+            live = self._start_live(tckr)
+            if live is None:
+                return None
+        # The position variables are per ticker here, swap this ticker's in so _open_pos/_close_pos can be used
+        for var in self.position_vars:
+            setattr(self, var, live[var])
+        if live['pending'] is not None:
+            order, signal_date = live['pending']
+            live['pending'] = None
+            if order == 'close':
+                self._close_pos(tckr, {'date': signal_date, 'next_open': bar['open']})
+            else:
+                self._open_pos(tckr, {'date': signal_date, 'next_open': bar['open']}, order)
+        row = live['state'].update(bar['close'], bar['high'], bar['low'], bar['volume'])
+        frame = _BarFrame(dict(bar, **row))
+        row['open_signal'] = 0.0
+        row['close_signal'] = 0.0
+        if self.open_pos is not None:
+            stopped = self.use_stop_loss and self.open_pos * bar['close'] < self.open_pos * self.stop_price
+            if stopped or self._exit_conditions(frame)[0]:
+                live['pending'] = ('close', bar['date'])
+                row['close_signal'] = float(self.open_pos)
+        else:
+            long_entry, short_entry = self._entry_conditions(frame)
+            direction = -1 if short_entry[0] else 1 if long_entry[0] else 0
+            if direction:
+                live['pending'] = (direction, bar['date'])
+                row['open_signal'] = float(direction)
+        for var in self.position_vars:
+            live[var] = getattr(self, var)
+        return row
 
     def _set_params(self, params):
         # See skeleton class file for an idea how it works
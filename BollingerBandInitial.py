@@ -2,9 +2,8 @@ import pandas as pd
 import numpy as np
 from utils import *
 from DataManager import DataManager
-import mplfinance as mpf
-import matplotlib.pyplot as plt
 from BaseStrategy import BaseStrategy
+from Indicators import add_bollinger_indicators, BollingerState
 
 
 class InitialStrategy(BaseStrategy):
@@ -12,10 +11,17 @@ class InitialStrategy(BaseStrategy):
     Simple strategy which looks for a squeeze of the Bollinger Band and then looks for direction of the next touch.
     No stop loss atm will look at implementing later.
     """
+    # The parameters add_indicators depends on, the rest only change the trading rules
+    indicator_params = ('window', 'width', 'bandwidth_window')
+    # The indicator columns the trading rules read, lean data only gets these
+    required_columns = ('perc_b', 'Thin Band Indicator', 'Thick Band Indicator')
+
     def __init__(self, portfolio, params):
         # Start the process when all indicators are available
-        self.portfolio = portfolio
+        # The indicators and signals go in an overlay, the caller's portfolio is never changed
+        self.portfolio = overlay(portfolio)
         super().__init__()
+        self.warn_still_open = True
         # parameters
         self._set_params(params)
         self.add_indicators()
@@ -47,63 +53,32 @@ class InitialStrategy(BaseStrategy):
 
     def add_indicators(self):
         """
-        Adds a bunch of indicators that are used in the strategy
+        Adds a bunch of indicators that are used in the strategy, see Indicators.bollinger_indicators for what they are
         """
-        for stock, data in self.portfolio.items():
-            # Volume Indicator Intraday intensity https://www.investopedia.com/terms/i/intradayintensityindex.asp
-            data['ma'] = data['close'].rolling(window=self.window).mean()
-            data['std'] = data['close'].rolling(window=self.window).std()
-            data['Bollinger High'] = data['ma'] + self.width * data['std']
-            data['Bollinger Low'] = data['ma'] - self.width * data['std']
-            data['Intensity'] = (((data['close'] * 2 - data['high'] - data['low'])
-                                  / ((data['high'] - data['low']) * data['volume']))).rolling(window=20).mean()
-            # A different volume indicator but I use intensity for the plots
-            data['Volume Indicator'] = 100 * data['volume'] / data['volume'].rolling(window=50).mean()
-            # This is a measure of how close to the band you are. 0 means hit lower band, 1 upper band, 0.5 means hitting moving average
-            data['perc_b'] = (data['close'] - data['Bollinger Low']) / (data['Bollinger High'] - data['Bollinger Low'])
-            # How wide the bands are, is a measure of volatility
-            data['BandWidth'] = (data['Bollinger High'] - data['Bollinger Low']) / data['ma']
-            # Gives an upper boundary for when bandwidth is high
-            data['BandWidth High'] = data['BandWidth'].rolling(window=self.bandwidth_window).max()
-            data['BandWidth Low'] = data['BandWidth'].rolling(window=self.bandwidth_window).min()
-            data['Thin Band Touch'] = np.where((data['BandWidth'] < 1.1*data['BandWidth Low']), 1, 0)
-            data['Thin Band Indicator'] = data['Thin Band Touch'].rolling(window=5).max()
-            data['Thick Band Indicator'] = np.where((data['BandWidth'] > 0.8 * data['BandWidth High']), 1, 0)
-            # Measure of the trend
-            data['Trend'] = data['ma'].diff().rolling(window=5).mean()
-            data['Trend of Trend'] = data['Trend'].diff().rolling(window=15).mean()
+        add_bollinger_indicators(self.portfolio, window=self.window, width=self.width,
+                                 bandwidth_window=self.bandwidth_window, columns=self.required_columns)
 
-    def run(self):
-        # THIS HERE IS THE STRATEGY. CAN POTENTIALLY EXTRAPOLATE OUT SLIGHTLY FURTHER BUT NOT SUFFICIENTLY COMPLEX YET
-        for tckr, data in self.portfolio.items():
-            self._reset_vars()
-            open_signal = np.zeros(len(self.portfolio[tckr]))
-            close_signal = np.zeros(len(open_signal))
-            for index, row in self.portfolio[tckr].iterrows():
-                # If there is no open position currently
-                if self.open_pos is None:
-                    # The conditions to open a position
-                    if row['Thin Band Indicator'] == 1 and row['perc_b'] < 0:
-                        self._open_short(tckr, row)
-                        open_signal[index] = -1
-                    elif row['Thin Band Indicator'] == 1 and row['perc_b'] > 1:
-                        self._open_long(tckr, row)
-                        open_signal[index] = 1
-                # What to look for when position is open
-                else:
-                    # close_signal indicator
-                    if row['Thick Band Indicator'] == 1:
-                        if self.open_pos == 1:
-                            self._close_pos(tckr, row)
-                            close_signal[index] = 1
-                        elif self.open_pos == -1:
-                            self._close_pos(tckr, row)
-                            close_signal[index] = -1
-            if self.open_pos is not None:
-                # Eventually need to do something about this
-                print("Position is still open")
-            data.insert(loc=len(data.columns), column='open_signal', value=open_signal)
-            data.insert(loc=len(data.columns), column='close_signal', value=close_signal)
+    def _indicator_state(self):
+        """
+        The same indicators as add_indicators worked out a bar at a time, used by update
+        """
+        return BollingerState(window=self.window, width=self.width, bandwidth_window=self.bandwidth_window)
+
+    def _entry_conditions(self, data):
+        """
+        THIS HERE IS THE STRATEGY. Open a long when the band has been thin and the close breaks above the upper band,
+        a short when it breaks below the lower band.
+        """
+        with np.errstate(invalid='ignore'):
+            thin_band = data['Thin Band Indicator'].values == 1
+            perc_b = data['perc_b'].values
+            return thin_band & (perc_b > 1), thin_band & (perc_b < 0)
+
+    def _exit_conditions(self, data):
+        """
+        Close the position once the bands are thick again
+        """
+        return data['Thick Band Indicator'].values == 1
 
 
 if __name__=='__main__':
@@ -0,0 +1,235 @@
+import json
+from datetime import datetime
+import os
+import numpy as np
+from TradeLedger import TradeLedger
+from Instrumentation import current_report
+from utils import date_str, overlay, set_column
+
+
+class Checkpoint:
+    """
+    Lets a long strategy run pick up where it left off after a crash. Every few tickers run saves a snapshot of its
+    progress: which tickers are done, the position variables, the trade ledger and the open/close signals of the
+    finished tickers. Passing the same Checkpoint to the next run skips the finished tickers. A snapshot is only
+    used by a run with the same strategy, params, indicators and data (see fingerprint) and not once the run that
+    saved it has finished.
+    The indicator columns are saved to a second file (again whenever they don't match the run's). restore_indicators
+    gives back an overlay of the data with them put back, to build the strategy on, so add_indicators doesn't have to
+    work them out again. They are only restored onto the same tickers and dates they were worked out on.
+    Both files are .npz (numpy arrays plus a small json header) written to a temporary file and renamed, so a crash
+    while saving leaves the previous snapshot intact.
+    """
+    version = 2
+
+    def __init__(self, path, every=50):
+        """
+        :param path: Where to save the snapshot, the indicators go next to it in path + '.indicators'
+        :param every: Save after this many tickers
+        """
+        self.path = path
+        self.indicators_path = path + '.indicators'
+        self.every = every
+        self._since_save = 0
+
+    @staticmethod
+    def _write(path, header, arrays):
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, header=np.array(json.dumps(header, default=_json_default)), **arrays)
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def _read_header(path):
+        """
+        :return: Just the json header of a saved file, None if there is no readable file
+        """
+        try:
+            with np.load(path) as npz:
+                return json.loads(str(npz['header']))
+        except (OSError, ValueError, EOFError, KeyError):
+            return None
+
+    @staticmethod
+    def _read(path):
+        """
+        :return: (header, arrays) or None if there is no readable file
+        """
+        try:
+            with np.load(path) as npz:
+                arrays = {name: npz[name] for name in npz.files}
+        except (OSError, ValueError, EOFError):
+            return None
+        return json.loads(str(arrays.pop('header'))), arrays
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    @staticmethod
+    def fingerprint(strategy):
+        """
+        What a run depends on: the strategy's params (its plain number/string attributes, so defaults count too),
+        the indicator settings and the first date, last date and number of rows of every ticker
+        :return: dict as it comes back out of the json header
+        """
+        position_vars = set(strategy.position_vars)
+        params = {name: value for name, value in sorted(vars(strategy).items())
+                  if not name.startswith('_') and name not in position_vars
+                  and isinstance(value, (bool, int, float, str, np.number))}
+        fingerprint = {'strategy': type(strategy).__name__, 'params': params,
+                       'indicators': _indicator_key(strategy.portfolio), 'tickers': _spans(strategy.portfolio)}
+        # Through json and back so it compares equal to the saved one (tuples become lists and so on)
+        return json.loads(json.dumps(fingerprint, default=_json_default))
+
+    def save(self, strategy, done, finished=False):
+        """
+        Saves the progress of strategy.run
+        :param done: The tickers finished so far, in order
+        :param finished: True once the run is over, a finished snapshot is never resumed from
+        """
+        header = {'version': self.version, 'fingerprint': self.fingerprint(strategy),
+                  'tickers': list(strategy.portfolio.keys()), 'done': list(done), 'finished': finished,
+                  'positions': {var: getattr(strategy, var) for var in strategy.position_vars}}
+        arrays = {'ledger_' + name: values for name, values in strategy.ledger.to_arrays().items()}
+        signals = [strategy.portfolio[tckr] for tckr in done]
+        header['lengths'] = [len(data) for data in signals]
+        for column in ('open_signal', 'close_signal'):
+            arrays[column] = np.concatenate([data[column].values for data in signals]).astype(np.int8) \
+                if signals else np.array([], dtype=np.int8)
+        self._write(self.path, header, arrays)
+        self._since_save = 0
+
+    def completed(self, strategy, done):
+        """
+        Called by run after each ticker, saves every self.every tickers
+        """
+        self._since_save += 1
+        if self._since_save >= self.every:
+            with current_report().stage('checkpoint'):
+                self.save(strategy, done)
+
+    def restore(self, strategy):
+        """
+        Puts the saved progress back into strategy, if the snapshot is of an unfinished run with the same fingerprint
+        :return: list of the tickers that are already done
+        """
+        saved = self._read(self.path)
+        if saved is None:
+            return []
+        header, arrays = saved
+        if header.get('version') != self.version or header['fingerprint'] != self.fingerprint(strategy):
+            print("Checkpoint {} is from a different run, starting from scratch".format(self.path))
+            return []
+        if header['finished']:
+            print("Checkpoint {} is from a run which finished, starting from scratch".format(self.path))
+            return []
+        strategy.ledger = TradeLedger.from_arrays({name[len('ledger_'):]: values for name, values in arrays.items()
+                                                   if name.startswith('ledger_')})
+        for var, value in header['positions'].items():
+            setattr(strategy, var, value)
+        start = 0
+        for tckr, length in zip(header['done'], header['lengths']):
+            data = strategy.portfolio[tckr]
+            for column in ('open_signal', 'close_signal'):
+                set_column(data, column, arrays[column][start:start + length].astype(np.float64))
+            start += length
+        print("Resuming from checkpoint, {} tickers already done".format(len(header['done'])))
+        return header['done']
+
+    @staticmethod
+    def _indicators_header(portfolio):
+        """
+        What saved indicators belong to: their settings and the first date, last date and rows of every ticker
+        """
+        header = {'version': Checkpoint.version, 'key': _indicator_key(portfolio), 'tickers': _spans(portfolio)}
+        return json.loads(json.dumps(header, default=_json_default))
+
+    def has_indicators(self, portfolio):
+        """
+        :return: True if the saved indicators are the ones of this portfolio (same settings, tickers and dates)
+        """
+        header = self._read_header(self.indicators_path)
+        return header is not None and header.get('key') is not None \
+            and {name: header.get(name) for name in ('version', 'key', 'tickers')} == \
+            self._indicators_header(portfolio)
+
+    def save_indicators(self, portfolio):
+        """
+        Saves the indicator columns of the portfolio, which are the columns after next_open added by add_indicators
+        """
+        header = self._indicators_header(portfolio)
+        if header['key'] is None:
+            return
+        first = next(iter(portfolio.values()))
+        columns = [column for column in first.columns[first.columns.get_loc('next_open') + 1:]
+                   if column not in ('open_signal', 'close_signal')]
+        header['columns'] = columns
+        arrays = {'col{}'.format(i): np.concatenate([data[column].to_numpy(dtype=np.float64)
+                                                     for data in portfolio.values()])
+                  for i, column in enumerate(columns)}
+        self._write(self.indicators_path, header, arrays)
+
+    def restore_indicators(self, portfolio, key=None):
+        """
+        Puts the saved indicator columns back, if they were worked out on the same tickers and dates as the
+        portfolio. The portfolio itself isn't changed, build the strategy on what comes back:
+
+            data = checkpoint.restore_indicators(portfolio) or portfolio
+
+        :param key: The indicator settings the strategy will use (e.g. ('bollinger', 20, 2, 125)), saved indicators
+                    of other settings aren't restored. Not checked if None, the strategy then recomputes them anyway
+                    if its settings differ from the restored ones
+        :return: An overlay of the portfolio (see utils.overlay) with the indicators marked as computed, or None if
+                 there are no saved indicators for it
+        """
+        saved = self._read(self.indicators_path)
+        if saved is None:
+            return None
+        header, arrays = saved
+        if header.get('version') != self.version or header['tickers'] != self._indicators_header(portfolio)['tickers']:
+            print("Indicators in {} are of different data, not restoring them".format(self.indicators_path))
+            return None
+        if key is not None and header['key'] != json.loads(json.dumps(list(key), default=_json_default)):
+            print("Indicators in {} have different settings, not restoring them".format(self.indicators_path))
+            return None
+        restored = overlay(portfolio)
+        start = 0
+        for tckr, _, _, length in header['tickers']:
+            data = restored[tckr]
+            for i, column in enumerate(header['columns']):
+                set_column(data, column, arrays['col{}'.format(i)][start:start + length])
+            data.attrs['indicators'] = tuple(header['key'])
+            start += length
+        return restored
+
+    def clear(self):
+        for path in (self.path, self.indicators_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def _indicator_key(portfolio):
+    first = next(iter(portfolio.values()), None)
+    return first.attrs.get('indicators') if first is not None else None
+
+
+def _spans(portfolio):
+    """
+    [tckr, first date, last date, rows] of every ticker
+    """
+    return [[tckr, date_str(data['date'].iloc[0]), date_str(data['date'].iloc[-1]), len(data)]
+            if len(data) else [tckr, None, None, 0] for tckr, data in portfolio.items()]
+
+
+def _json_default(value):
+    """
+    Lets the header hold the datetime64 dates of lean data (as strings) and numpy numbers
+    """
+    if isinstance(value, (np.datetime64, datetime)):
+        return date_str(value)
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError("Can't save {!r} in a checkpoint".format(value))
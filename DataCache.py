@@ -0,0 +1,79 @@
+import hashlib
+import json
+import os
+import pickle
+
+
+class DataCache:
+    """
+    A folder of pickled results keyed by a hash of everything that went into them (the call arguments and the
+    modification times of the source files). A changed source file changes the key so stale results are never
+    returned, they just age out. Once the folder is bigger than max_bytes the least recently used results are deleted.
+    """
+    version = 1
+
+    def __init__(self, path_to_cache, max_bytes=2 * 1024 ** 3):
+        self.path_to_cache = path_to_cache
+        self.max_bytes = max_bytes
+
+    def make_key(self, name, args, sources):
+        """
+        :param name: What is being cached, i.e. the function name
+        :param args: dict of the arguments of the call
+        :param sources: paths of the files the result was built from
+        :return: the hex digest used as the filename
+        """
+        stamps = []
+        for path in sources:
+            stat = os.stat(path)
+            stamps.append([os.path.basename(path), stat.st_mtime_ns, stat.st_size])
+        payload = json.dumps({'version': self.version, 'name': name, 'args': args, 'sources': stamps},
+                             sort_keys=True, default=str)
+        return hashlib.sha1(payload.encode()).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.path_to_cache, key + '.pkl')
+
+    def get(self, key):
+        """
+        :return: The cached result or None if there isn't one
+        """
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                result = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+        # Mark as recently used for the eviction
+        os.utime(path)
+        return result
+
+    def put(self, key, result):
+        os.makedirs(self.path_to_cache, exist_ok=True)
+        path = self._path(key)
+        # Write then rename so a crash never leaves half a pickle behind
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+        self._evict()
+
+    def _evict(self):
+        entries = []
+        for filename in os.listdir(self.path_to_cache):
+            if filename.endswith('.pkl'):
+                stat = os.stat(os.path.join(self.path_to_cache, filename))
+                entries.append((stat.st_mtime, stat.st_size, filename))
+        total = sum(size for _, size, _ in entries)
+        # Oldest first, always keep the newest even if it is bigger than max_bytes on its own
+        for _, size, filename in sorted(entries)[:-1]:
+            if total <= self.max_bytes:
+                break
+            os.remove(os.path.join(self.path_to_cache, filename))
+            total -= size
+
+    def clear(self):
+        if os.path.isdir(self.path_to_cache):
+            for filename in os.listdir(self.path_to_cache):
+                if filename.endswith('.pkl'):
+                    os.remove(os.path.join(self.path_to_cache, filename))
@@ -0,0 +1,89 @@
+import json
+import os
+import re
+
+
+class DataIndex:
+    """
+    Index of the saved S&P files: filename -> symbol and sector.
+    It is built once from a single directory listing (and saved to path_to_index if given) so the loaders can pick a
+    sector or a random sample without rescanning the directory or regex matching every filename on every call.
+    Building it only parses the filenames, none of the files are opened.
+    """
+    version = 1
+
+    def __init__(self, files, entries, source_mtime=None):
+        """
+        :param files: Every filename in the data directory in listdir order (get_all_sector_SP samples from these)
+        :param entries: {filename: {'symbol', 'sector'}} for every valid file
+        :param source_mtime: mtime of the data directory when the index was built, used to spot stale indexes
+        """
+        self.files = files
+        self.entries = entries
+        self.source_mtime = source_mtime
+        self.by_sector = {}
+        for filename in files:
+            entry = entries.get(filename)
+            if entry is None:
+                continue
+            self.by_sector.setdefault(entry['sector'], []).append(filename)
+
+    @staticmethod
+    def parse_filename(filename):
+        """
+        Splits a filename like APA3.csv into its symbol and sector number, None if it isn't in that format
+        """
+        match = re.match(r"([a-z]+)([0-9]+)", filename, re.I)
+        if match is None:
+            return None
+        return match.groups()[0], int(match.groups()[1])
+
+    @classmethod
+    def build(cls, files, source_mtime=None):
+        """
+        :param files: Every filename in the data directory in listdir order
+        """
+        entries = {}
+        for filename in files:
+            parsed = cls.parse_filename(filename)
+            if parsed is None:
+                print("Wtf is going on: {}".format(filename))
+                continue
+            entries[filename] = {'symbol': parsed[0], 'sector': parsed[1]}
+        return cls(list(files), entries, source_mtime)
+
+    @classmethod
+    def load(cls, path_to_index):
+        """
+        :return: The saved index or None if there isn't one (or it is from an older version)
+        """
+        if path_to_index is None or not os.path.isfile(path_to_index):
+            return None
+        with open(path_to_index) as f:
+            saved = json.load(f)
+        if saved.get('version') != cls.version:
+            return None
+        return cls(saved['files'], saved['entries'], saved['source_mtime'])
+
+    def save(self, path_to_index):
+        folder = os.path.dirname(path_to_index)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        with open(path_to_index, 'w') as f:
+            json.dump({'version': self.version, 'files': self.files, 'entries': self.entries,
+                       'source_mtime': self.source_mtime}, f)
+
+    def sector_files(self, sector_number):
+        """
+        The filenames in one sector, in listdir order
+        """
+        return self.by_sector.get(sector_number, [])
+
+    def sample_files(self, positions):
+        """
+        The valid filenames at the given positions of the directory listing, in listdir order
+        """
+        return [self.files[i] for i in sorted(positions) if self.files[i] in self.entries]
+
+    def symbol(self, filename):
+        return self.entries[filename]['symbol']
@@ -1,101 +1,294 @@
-import requests
-from bs4 import BeautifulSoup
 import pandas as pd
-from io import StringIO
 import os.path
-import matplotlib.pyplot as plt
-import sys
-import re
-import time
+import hashlib
 import numpy as np
 from statistics import mode
 import random
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import repeat
+from PriceStore import PriceStore
+from DataIndex import DataIndex
+from DataCache import DataCache
+from PricePanel import PricePanel
+from Instrumentation import current_report
+from Resampler import resample, complete_bars, CALENDAR_RULES
 
 class DataManager:
-    def __init__(self, path_to_data=None):
+    # Columns only the indicators (and nothing that is traded) read, safe to keep as float32 in lean data
+    lean_float32 = ('high', 'low', 'adjusted_close', 'volume', 'dividend_amount', 'split_coefficient')
+
+    def __init__(self, path_to_data=None, path_to_store=None, workers=1, executor='process', path_to_index=None,
+                 path_to_cache=None, cache_size=2 * 1024 ** 3):
         # Alpha vantage API KEY
         self.path_to_data = path_to_data
+        # Optional columnar copy of the csv files, see ingest_SP
+        self.store = PriceStore(path_to_store) if path_to_store is not None else None
+        # Number of files loaded at once, 1 loads them one after another. executor is 'process' or 'thread'
+        self.workers = workers
+        self.executor = executor
+        # Where the filename index is saved, defaults to inside the store (or just kept in memory without a store)
+        self.path_to_index = path_to_index
+        self._index = None
+        # Optional cache of prepared data, see load_prepared. cache_size is in bytes
+        self.cache = DataCache(path_to_cache, max_bytes=cache_size) if path_to_cache is not None else None
         # List of the sectors wikipedia breaks the S&P into
         self.categoryList = {"Communication Services": 0, "Consumer Discretionary": 1, "Consumer Staples": 2,
                              "Energy": 3, "Financials": 4, "Health Care": 5, "Industrials": 6,
                              "Information Technology": 7, "Materials": 8, "Real Estate": 9, "Utilities": 10}
 
-    def _convert_weekly(self, df):
-        df['Date'] = pd.to_datetime(df.index)
-        weekly = df
-        weekly['Week Number'] = df['Date'].dt.week
-        weekly['Year'] = df['Date'].dt.year
-        weekly = weekly.groupby(['Year', 'Week Number']).agg(
-            {'open': 'first', 'high': 'max', 'low': 'min', 'close': 'last',
-             'adjusted_close': 'last', 'volume': 'sum',
-             'dividend_amount': 'sum', 'split_coefficient': 'max'})
-        # Drop first and last as not sure if they are full weeks
-        weekly.drop(weekly.tail(1).index, inplace=True)
-        weekly.drop(weekly.head(1).index, inplace=True)
-        return weekly
+    def _use_store(self):
+        return self.store is not None and self.store.exists()
+
+    def _index_path(self):
+        if self.path_to_index is not None:
+            return self.path_to_index
+        if self.store is not None:
+            return os.path.join(self.store.path_to_store, 'index.json')
+        if self.cache is not None:
+            # Kept with the cache so a cache hit in a fresh process doesn't even list the directory. Named after the
+            # data directory in case the cache is shared
+            name = hashlib.sha1(os.path.abspath(self.path_to_data).encode()).hexdigest()[:12]
+            return os.path.join(self.cache.path_to_cache, 'index-{}.json'.format(name))
+        return None
+
+    def _index_source_mtime(self):
+        """
+        When the files were last added/removed (or the store rebuilt), a saved index older than this is rebuilt
+        """
+        if self._use_store():
+            return os.path.getmtime(os.path.join(self.store.path_to_store, 'meta.json'))
+        return os.path.getmtime(self.path_to_data)
+
+    @property
+    def index(self):
+        """
+        The DataIndex of the saved files, loaded from path_to_index or built from one directory listing the first
+        time it is needed
+        """
+        if self._index is None:
+            path = self._index_path()
+            source_mtime = self._index_source_mtime()
+            index = DataIndex.load(path)
+            if index is None or index.source_mtime != source_mtime:
+                # Only the filenames are parsed here, none of the files are opened
+                files = self.store.files if self._use_store() else os.listdir(self.path_to_data)
+                index = DataIndex.build(files, source_mtime)
+                if path is not None:
+                    index.save(path)
+            self._index = index
+        return self._index
+
+    def _read_csv(self, filename):
+        """
+        Reads a whole saved file, oldest date first
+        """
+        df = pd.read_csv(self.path_to_data + filename, index_col=1).iloc[::-1]
+        return df.drop(df.columns[0], axis=1)
+
+    def _load_file(self, filename, fromDate, toDate, columns=None):
+        if self._use_store():
+            return self.store.load(filename, fromDate, toDate, columns=columns)
+        df = self._read_csv(filename)[fromDate:toDate]
+        if columns is not None:
+            df = df[columns]
+        return df
+
+    def _resampled_store(self, timeframe):
+        """
+        The PriceStore of timeframe bars, kept in a folder of the daily store
+        """
+        return PriceStore(os.path.join(self.store.path_to_store, 'resampled', str(timeframe)))
+
+    def _use_resampled(self, timeframe):
+        """
+        True if there is a resampled store of timeframe bars that is at least as new as the daily store
+        """
+        if timeframe not in CALENDAR_RULES or not self._use_store():
+            return False
+        store = self._resampled_store(timeframe)
+        return store.exists() and os.path.getmtime(os.path.join(store.path_to_store, 'meta.json')) \
+            >= os.path.getmtime(os.path.join(self.store.path_to_store, 'meta.json'))
+
+    def _load_one(self, filename, fromDate, toDate, columns=None, stored_timeframe=None):
+        if stored_timeframe is not None:
+            return self._resampled_store(stored_timeframe).load(filename, fromDate, toDate, columns=columns)
+        return self._load_file(filename, fromDate, toDate, columns)
+
+    def _load_files(self, filenames, fromDate, toDate, columns=None, timeframe=None):
+        """
+        Loads every file in filenames, spread over a pool of self.workers if there is more than one.
+        :param timeframe: Resample to 'week', 'month' or N-day bars (see Resampler), None for the daily bars. Read
+                          from the resampled store if ingest_resampled has been run for it
+        :return: list of the DataFrames in the same order as filenames
+        """
+        report = current_report()
+        stored_timeframe = timeframe if timeframe is not None and self._use_resampled(timeframe) else None
+        with report.stage('load'):
+            if self.workers is None or self.workers <= 1 or len(filenames) <= 1:
+                frames = [self._load_one(filename, fromDate, toDate, columns, stored_timeframe)
+                          for filename in filenames]
+            else:
+                pool = ProcessPoolExecutor if self.executor == 'process' else ThreadPoolExecutor
+                chunksize = max(1, len(filenames) // (4 * self.workers))
+                with pool(max_workers=self.workers) as executor:
+                    frames = list(executor.map(self._load_one, filenames, repeat(fromDate), repeat(toDate),
+                                               repeat(columns), repeat(stored_timeframe), chunksize=chunksize))
+        report.count('files_loaded', len(frames))
+        report.count('rows_loaded', sum(len(df) for df in frames))
+        if timeframe is not None:
+            with report.stage('resample'):
+                # All the files are resampled together, the filenames are just keys here
+                keyed = dict(zip(range(len(frames)), frames))
+                if stored_timeframe is not None:
+                    frames = list(complete_bars(keyed, timeframe, fromDate, toDate).values())
+                else:
+                    frames = list(resample(keyed, timeframe, fromDate, toDate).values())
+            report.count('bars_resampled', sum(len(df) for df in frames))
+        return frames
+
+    def ingest_SP(self):
+        """
+        One off conversion of the saved csv files into the columnar store at path_to_store. Once this has been run
+        get_one_sector_SP and get_all_sector_SP read from the store instead of parsing the csv files. Rerun it if
+        the csv files change.
+        """
+        if self.store is None:
+            raise ValueError("DataManager needs a path_to_store to ingest into")
+        self.store.ingest(os.listdir(self.path_to_data), self._read_csv, DataIndex.parse_filename)
+        self._index = None
+
+    def ingest_resampled(self, timeframe='week'):
+        """
+        Resamples the whole history in the store to 'week' or 'month' bars once and saves them as another store, so
+        loading with that timeframe doesn't aggregate the daily bars every time. Rerun it after ingest_SP.
+        """
+        if not self._use_store():
+            raise ValueError("Run ingest_SP before ingest_resampled")
+        if timeframe not in CALENDAR_RULES:
+            raise ValueError("Only 'week' and 'month' bars can be saved, N-day bars depend on the first date loaded")
+        files = list(self.store.meta['entries'].keys())
+        bars = resample({filename: self.store.load(filename) for filename in files}, timeframe, complete=False)
+        self._resampled_store(timeframe).ingest(self.store.files, lambda filename: bars[filename],
+                                                lambda filename: DataIndex.parse_filename(filename)
+                                                if filename in bars else None)
 
+    def _select_sector(self, sector):
+        """
+        :return: The filenames in the sector
+        """
+        return self.index.sector_files(self.categoryList[sector])
 
-    def get_one_sector_SP(self, sector="Energy", fromDate="2015-01-01", toDate="2020-09-21", weekly=False):
+    def _select_sample(self, limit):
+        """
+        :return: A random (but always the same for the same limit) selection of limit filenames
+        """
+        seed = 7
+        random.seed(seed)
+        count_files = len(self.index.files)
+        try:
+            sample = random.sample(range(count_files), limit)
+        except ValueError:
+            sample = np.arange(0, count_files)
+        return self.index.sample_files(sample)
+
+    def get_one_sector_SP(self, sector="Energy", fromDate="2015-01-01", toDate="2020-09-21", weekly=False,
+                          columns=None, panel=False, timeframe=None):
         """
         This is the most used function of this class. It doesn't fetch from Alphavantage but from the saved files you get from fetchSP
         :param sector: The sector you want to fetch
         :param fromDate: The date you want to start fetching
         :param toDate: the date you want to end fetching
+        :param columns: Only load these columns, defaults to all of them
+        :param panel: Return a date aligned PricePanel instead of the dictionary
+        :param timeframe: 'week', 'month' or N for N-day bars instead of daily ones, weekly=True is the same as 'week'
         :return: empty but saves the data to self.data as a dictionary in the format {[tckr]: data} for every ticker
         """
-        sector_number = self.categoryList[sector]
+        selected = self._select_sector(sector)
+        if weekly == True:
+            timeframe = 'week'
+        frames = self._load_files(selected, fromDate, toDate, columns, timeframe=timeframe)
         sector_dict = {}
-        for filename in os.listdir(self.path_to_data):
-            if str(sector_number) in filename:
-                try:
-                    symbol = re.match(r"([a-z]+)([0-9]+)", filename, re.I).groups()[0]
-                except:
-                    print("Wtf is going on: {}".format(filename))
-                    continue
-                sector_dict[str(symbol)] = pd.read_csv(self.path_to_data + filename, index_col=1).iloc[::-1]
-                sector_dict[str(symbol)] = sector_dict[str(symbol)].drop(sector_dict[str(symbol)].columns[0], axis=1)
-                sector_dict[str(symbol)] = sector_dict[str(symbol)][fromDate:toDate]
-                if weekly==True:
-                    sector_dict[str(symbol)] = self._convert_weekly(sector_dict[str(symbol)])
+        for filename, df in zip(selected, frames):
+            sector_dict[str(self.index.symbol(filename))] = df
 
         data_dict = sector_dict
         data_dict = self._remove_incomplete_data(data_dict)
+        if panel:
+            return self.to_panel(data_dict)
         return data_dict
 
-    def get_all_sector_SP(self, fromDate="2015-01-01", toDate="2020-09-21", limit=150, cleanse=True):
+    def get_all_sector_SP(self, fromDate="2015-01-01", toDate="2020-09-21", limit=150, cleanse=True, columns=None,
+                          panel=False, timeframe=None):
         """
         This is the most used function of this class. It doesn't fetch from Alphavantage but from the saved files you get from fetchSP
         :param sector: The sector you want to fetch
         :param fromDate: The date you want to start fetching
         :param toDate: the date you want to end fetching
+        :param columns: Only load these columns, defaults to all of them
+        :param panel: Return a date aligned PricePanel instead of the dictionary
+        :param timeframe: 'week', 'month' or N for N-day bars instead of daily ones
         :return: empty but saves the data to self.data as a dictionary in the format {[tckr]: data} for every ticker
         """
+        selected = self._select_sample(limit)
+        frames = self._load_files(selected, fromDate, toDate, columns, timeframe=timeframe)
         sector_dict = {}
-        seed = 7
-        random.seed(seed)
-        files = os.listdir(self.path_to_data)
-        count_files = len(files)
-        counter = 0
-        try:
-            sample = random.sample(range(count_files), limit)
-        except ValueError:
-            sample = np.arange(0, count_files)
-        for filename in os.listdir(self.path_to_data):
-            if counter in sample:
-                try:
-                    symbol = re.match(r"([a-z]+)([0-9]+)", filename, re.I).groups()[0]
-                except:
-                    print("Wtf is going on: {}".format(filename))
-                    continue
-                sector_dict[str(symbol)] = pd.read_csv(self.path_to_data + filename, index_col=1).iloc[::-1]
-                sector_dict[str(symbol)] = sector_dict[str(symbol)].drop(sector_dict[str(symbol)].columns[0], axis=1)
-                sector_dict[str(symbol)] = sector_dict[str(symbol)][fromDate:toDate]
-            counter += 1
+        for filename, df in zip(selected, frames):
+            sector_dict[str(self.index.symbol(filename))] = df
         data_dict = sector_dict
         if cleanse:
             data_dict = self._remove_incomplete_data(data_dict)
+        if panel:
+            return self.to_panel(data_dict)
         return data_dict
 
+    def to_panel(self, data_dict, columns=None):
+        """
+        Converts the {[tckr]: data} dictionary (loaded or prepared) into a date aligned PricePanel
+        :param columns: Only include these columns, defaults to every numeric column
+        """
+        return PricePanel.from_dict(data_dict, columns=columns)
+
+    def load_prepared(self, sector=None, fromDate="2015-01-01", toDate="2020-09-21", weekly=False, limit=150,
+                      cleanse=True, lean=False, timeframe=None):
+        """
+        get_one_sector_SP (if a sector is given) or get_all_sector_SP (if not) followed by prepare_data. If the
+        DataManager has a path_to_cache the result is cached, so running again with the same arguments skips loading
+        and preparing entirely. The cache is invalidated when any of the source files change. The file index is saved
+        with the cache, so a hit only reads the index and the modification times of the chosen files.
+        :param lean: See prepare_data
+        :param timeframe: See get_one_sector_SP
+        :return: The prepared data in the format {[tckr]: data}
+        """
+        if sector is not None:
+            args = {'sector': sector, 'fromDate': fromDate, 'toDate': toDate, 'weekly': weekly}
+            selected = self._select_sector(sector)
+        else:
+            args = {'fromDate': fromDate, 'toDate': toDate, 'limit': limit, 'cleanse': cleanse}
+            selected = self._select_sample(limit)
+        if lean:
+            args['lean'] = True
+        if timeframe is not None:
+            args['timeframe'] = timeframe
+        if self.cache is not None:
+            if self._use_store():
+                sources = [os.path.join(self.store.path_to_store, 'meta.json')]
+            else:
+                sources = [self.path_to_data + filename for filename in selected]
+            key = self.cache.make_key('load_prepared', args, sources)
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached
+        if sector is not None:
+            data = self.get_one_sector_SP(sector=sector, fromDate=fromDate, toDate=toDate, weekly=weekly,
+                                          timeframe=timeframe)
+        else:
+            data = self.get_all_sector_SP(fromDate=fromDate, toDate=toDate, limit=limit, cleanse=cleanse,
+                                          timeframe=timeframe)
+        data = self.prepare_data(data, lean=lean)
+        if self.cache is not None:
+            self.cache.put(key, data)
+        return data
+
     def _remove_incomplete_data(self, data):
         """
         Cleans up the data to ensure they are all the same size, some symbols don't have full amount of data
@@ -105,25 +298,60 @@ class DataManager:
         for symbol, dataframe in data.items():
             size_array.append(dataframe.shape[0])
         mode_size = mode(size_array)
-        data = {k:v for k, v in data.items() if v.shape[0] == mode_size}
-        return data
+        cleaned = {k:v for k, v in data.items() if v.shape[0] == mode_size}
+        current_report().count('tickers_dropped_incomplete', len(data) - len(cleaned))
+        return cleaned
 
-    def prepare_data(self, data_dict):
+    def prepare_data(self, data_dict, lean=False):
         """
         This needs to be general to all strategies. If I start fiddling with it then I need to change how it works
+        :param lean: Keep the data small, for big universes and Monte Carlo. Dates become datetime64, the columns
+                     which are only used by indicators become float32 and the strategies only add the indicator
+                     columns they read (their required_columns) with the 0/1 flags as int8. open, close and next_open
+                     stay float64 because the trades are priced off them
         """
+        report = current_report()
         clean_data_dict = {}
-        for symbol, df in data_dict.items():
-            clean_data = df.dropna()
-            if 'date' not in clean_data.columns:
-                clean_data.index.name = 'date'
-                clean_data.reset_index(inplace=True)
-            clean_data.insert(loc=len(clean_data.columns), column='next_open', value=clean_data['open'].shift(-1))
-            if df['split_coefficient'].max() != 1 or df['split_coefficient'].min() != 1:
-                continue
-            clean_data_dict[symbol] = clean_data
+        with report.stage('prepare'):
+            for symbol, df in data_dict.items():
+                clean_data = df.dropna()
+                if 'date' not in clean_data.columns:
+                    clean_data.index.name = 'date'
+                    clean_data.reset_index(inplace=True)
+                clean_data.insert(loc=len(clean_data.columns), column='next_open',
+                                  value=clean_data['open'].shift(-1))
+                if df['split_coefficient'].max() != 1 or df['split_coefficient'].min() != 1:
+                    report.count('tickers_dropped_split')
+                    continue
+                if lean:
+                    clean_data = self._make_lean(clean_data)
+                report.count('rows_prepared', len(clean_data))
+                clean_data_dict[symbol] = clean_data
         return clean_data_dict
 
+    def _make_lean(self, data):
+        """
+        The compact dtypes of prepare_data with lean=True
+        """
+        dtypes = {col: np.float32 for col in self.lean_float32 if col in data.columns}
+        if data['date'].dtype == object:
+            dtypes['date'] = 'datetime64[ns]'
+        data = data.astype(dtypes)
+        data.attrs['lean'] = True
+        return data
+
+    @staticmethod
+    def memory_report(data_dict):
+        """
+        How much memory each ticker's DataFrame takes
+        :return: DataFrame indexed by ticker with its rows, bytes and bytes_per_row, plus a 'total' row
+        """
+        rows = {tckr: (len(df), int(df.memory_usage(deep=True).sum())) for tckr, df in data_dict.items()}
+        report = pd.DataFrame.from_dict(rows, orient='index', columns=['rows', 'bytes'])
+        report.loc['total'] = report.sum()
+        report['bytes_per_row'] = report['bytes'] / report['rows'].where(report['rows'] > 0)
+        return report
+
 
 
 
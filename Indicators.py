@@ -0,0 +1,391 @@
+import math
+from collections import deque
+import numpy as np
+from Instrumentation import current_report
+from utils import set_column
+
+"""
+Indicator engine shared by the strategies. Everything works on (dates x tickers) arrays so the whole universe is
+computed in one go instead of one pandas Series at a time. Windows follow pandas rolling with min_periods=window:
+a value is NaN unless every value in its window is finite.
+"""
+
+
+# The columns bollinger_indicators adds, in order, and the ones each of them is worked out from
+BOLLINGER_COLUMNS = ('ma', 'std', 'Bollinger High', 'Bollinger Low', 'Intensity', 'Volume Indicator', 'perc_b',
+                     'BandWidth', 'BandWidth High', 'BandWidth Low', 'Thin Band Touch', 'Thin Band Indicator',
+                     'Thick Band Indicator', 'Trend', 'Trend of Trend')
+_DEPENDS = {'Bollinger High': ('ma', 'std'), 'Bollinger Low': ('ma', 'std'),
+            'perc_b': ('Bollinger High', 'Bollinger Low'), 'BandWidth': ('Bollinger High', 'Bollinger Low', 'ma'),
+            'BandWidth High': ('BandWidth',), 'BandWidth Low': ('BandWidth',),
+            'Thin Band Touch': ('BandWidth', 'BandWidth Low'), 'Thin Band Indicator': ('Thin Band Touch',),
+            'Thick Band Indicator': ('BandWidth', 'BandWidth High'), 'Trend': ('ma',), 'Trend of Trend': ('Trend',)}
+# 0/1 flags, stored as int8 in lean data
+FLAG_COLUMNS = ('Thin Band Touch', 'Thin Band Indicator', 'Thick Band Indicator')
+
+
+def _needed(columns):
+    """
+    The columns plus everything they are worked out from
+    """
+    needed = set()
+    stack = list(columns)
+    while stack:
+        column = stack.pop()
+        if column not in needed:
+            needed.add(column)
+            stack.extend(_DEPENDS.get(column, ()))
+    return needed
+
+
+def _as_2d(values):
+    values = np.asarray(values, dtype=np.float64)
+    return values.reshape(len(values), -1) if values.ndim == 1 else values
+
+
+def _window_total(cumulative, window, n):
+    """
+    Turns a cumulative sum (with a leading row of zeros) into the totals over each window ending at each row
+    """
+    out = np.full((n,) + cumulative.shape[1:], np.nan)
+    if window <= n:
+        out[window - 1:] = cumulative[window:] - cumulative[:-window]
+    return out
+
+
+# Rows of output worked out from one set of running sums, see _rolling_moments
+_SEGMENT = 1024
+
+
+def _segment_moments(values, window, with_var):
+    """
+    Rolling mean (and sample variance) of one stretch of rows from running sums, with the values centred on the
+    stretch's own mean first so the sum of squares doesn't lose precision
+    """
+    n = values.shape[0]
+    finite = np.isfinite(values)
+    found = finite.sum(axis=0)
+    offset = np.where(finite, values, 0.0).sum(axis=0) / np.maximum(found, 1)
+    centred = np.where(finite, values - offset, 0.0)
+    zeros = np.zeros((1,) + values.shape[1:])
+    counts = _window_total(np.concatenate([zeros, np.cumsum(finite, axis=0)]), window, n)
+    complete = counts == window
+    sums = _window_total(np.concatenate([zeros, np.cumsum(centred, axis=0)]), window, n)
+    mean = np.where(complete, sums / window + offset, np.nan)
+    if not with_var:
+        return mean, None
+    squares = _window_total(np.concatenate([zeros, np.cumsum(centred * centred, axis=0)]), window, n)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        var = (squares - sums * sums / window) / (window - 1)
+    var = np.where(complete, np.maximum(var, 0.0), np.nan)
+    return mean, var
+
+
+def _rolling_moments(values, window, with_var=False):
+    """
+    O(n) rolling mean (and sample variance) from running sums. The sums are restarted every _SEGMENT rows (each
+    stretch also reading the window - 1 rows before it) and centred on that stretch's mean. One mean for the whole
+    history isn't enough for a stock whose price moves by orders of magnitude, the sums of squares get so big that
+    the variance of the cheap years is lost in the rounding.
+    """
+    values = _as_2d(values)
+    n = values.shape[0]
+    mean = np.full(values.shape, np.nan)
+    var = np.full(values.shape, np.nan) if with_var else None
+    step = max(_SEGMENT, window)
+    for start in range(window - 1, n, step):
+        stop = min(start + step, n)
+        segment_mean, segment_var = _segment_moments(values[start - window + 1:stop], window, with_var)
+        mean[start:stop] = segment_mean[window - 1:]
+        if with_var:
+            var[start:stop] = segment_var[window - 1:]
+    return mean, var
+
+
+def rolling_mean(values, window):
+    return _rolling_moments(values, window)[0]
+
+
+def rolling_std(values, window):
+    """
+    Sample standard deviation (ddof=1) like pandas
+    """
+    return np.sqrt(_rolling_moments(values, window, with_var=True)[1])
+
+
+def _rolling_extreme(values, window, func):
+    """
+    O(n) rolling max/min using the van Herk/Gil-Werman trick, the vectorised equivalent of a monotonic deque.
+    The rows are cut into blocks of size window, each window is then func(suffix of one block, prefix of the next).
+    """
+    values = _as_2d(values)
+    values = np.where(np.isfinite(values), values, np.nan)
+    n = values.shape[0]
+    out = np.full(values.shape, np.nan)
+    if window > n:
+        return out
+    pad = (-n) % window
+    padded = np.concatenate([values, np.full((pad,) + values.shape[1:], np.nan)])
+    blocks = padded.reshape((-1, window) + values.shape[1:])
+    prefix = func.accumulate(blocks, axis=1).reshape(padded.shape)
+    suffix = func.accumulate(blocks[:, ::-1], axis=1)[:, ::-1].reshape(padded.shape)
+    out[window - 1:] = func(suffix[:n - window + 1], prefix[window - 1:n])
+    return out
+
+
+def rolling_max(values, window):
+    return _rolling_extreme(values, window, np.maximum)
+
+
+def rolling_min(values, window):
+    return _rolling_extreme(values, window, np.minimum)
+
+
+def diff(values):
+    values = _as_2d(values)
+    out = np.full(values.shape, np.nan)
+    out[1:] = values[1:] - values[:-1]
+    return out
+
+
+def bollinger_indicators(close, high, low, volume, window=20, width=2, bandwidth_window=125, columns=None):
+    """
+    The Bollinger Band indicator set used by the strategies, for every ticker at once.
+    :param close, high, low, volume: (dates x tickers) arrays. high, low and volume are only needed for Intensity and
+                                     Volume Indicator
+    :param columns: Only give back these columns (and only work out what they need), defaults to all of them
+    :return: {column name: (dates x tickers) array} in the order the strategies add them
+    """
+    columns = BOLLINGER_COLUMNS if columns is None else [column for column in BOLLINGER_COLUMNS if column in columns]
+    need = _needed(columns)
+    close = _as_2d(close)
+    ind = {}
+    with np.errstate(invalid='ignore', divide='ignore'):
+        if need & {'ma', 'std'}:
+            ind['ma'], var = _rolling_moments(close, window, with_var='std' in need)
+        if 'std' in need:
+            ind['std'] = np.sqrt(var)
+        if 'Bollinger High' in need:
+            ind['Bollinger High'] = ind['ma'] + width * ind['std']
+            ind['Bollinger Low'] = ind['ma'] - width * ind['std']
+        if 'Intensity' in need:
+            high, low, volume = _as_2d(high), _as_2d(low), _as_2d(volume)
+            # Volume Indicator Intraday intensity https://www.investopedia.com/terms/i/intradayintensityindex.asp
+            ind['Intensity'] = rolling_mean((close * 2 - high - low) / ((high - low) * volume), 20)
+        if 'Volume Indicator' in need:
+            volume = _as_2d(volume)
+            # A different volume indicator but I use intensity for the plots
+            ind['Volume Indicator'] = 100 * volume / rolling_mean(volume, 50)
+        if 'perc_b' in need:
+            # This is a measure of how close to the band you are. 0 means hit lower band, 1 upper band
+            ind['perc_b'] = (close - ind['Bollinger Low']) / (ind['Bollinger High'] - ind['Bollinger Low'])
+        if 'BandWidth' in need:
+            # How wide the bands are, is a measure of volatility
+            ind['BandWidth'] = (ind['Bollinger High'] - ind['Bollinger Low']) / ind['ma']
+        if 'BandWidth High' in need:
+            ind['BandWidth High'] = rolling_max(ind['BandWidth'], bandwidth_window)
+        if 'BandWidth Low' in need:
+            ind['BandWidth Low'] = rolling_min(ind['BandWidth'], bandwidth_window)
+        if 'Thin Band Touch' in need:
+            ind['Thin Band Touch'] = np.where(ind['BandWidth'] < 1.1 * ind['BandWidth Low'], 1, 0)
+        if 'Thin Band Indicator' in need:
+            ind['Thin Band Indicator'] = rolling_max(ind['Thin Band Touch'], 5)
+        if 'Thick Band Indicator' in need:
+            ind['Thick Band Indicator'] = np.where(ind['BandWidth'] > 0.8 * ind['BandWidth High'], 1, 0)
+        # Measure of the trend
+        if 'Trend' in need:
+            ind['Trend'] = rolling_mean(diff(ind['ma']), 5)
+        if 'Trend of Trend' in need:
+            ind['Trend of Trend'] = rolling_mean(diff(ind['Trend']), 15)
+    return {column: ind[column] for column in columns}
+
+
+def _stack(portfolio, column):
+    """
+    Stacks one column of every ticker into a (dates x tickers) array. Shorter histories are padded with NaN at the
+    end, which can't affect the backward looking windows of the real rows.
+    """
+    lengths = [len(data) for data in portfolio.values()]
+    out = np.full((max(lengths), len(lengths)), np.nan, order='F')
+    for i, data in enumerate(portfolio.values()):
+        out[:lengths[i], i] = data[column].to_numpy(dtype=np.float64)
+    return out
+
+
+def add_bollinger_indicators(portfolio, window=20, width=2, bandwidth_window=125, columns=None):
+    """
+    Adds the Bollinger Band indicator columns to every DataFrame of the {tckr: data} portfolio. Computes the same
+    columns as the old per ticker pandas code, but for the whole portfolio in one pass.
+    The DataFrames are marked (in DataFrame.attrs) with the settings used, if they already have these indicators
+    nothing is recomputed. That lets a parameter sweep share one set of indicators between all the strategies that
+    only differ in their trading thresholds, and slices of the data keep the values worked out on the full history.
+    :param columns: The columns the strategy reads (its required_columns). In lean data (DataManager.prepare_data
+                    with lean=True) only these are added and the flags are int8, otherwise every column is added
+    """
+    if not portfolio:
+        return
+    key = ('bollinger', window, width, bandwidth_window)
+    lean = columns is not None and all(data.attrs.get('lean') for data in portfolio.values())
+    if not lean:
+        columns = BOLLINGER_COLUMNS
+    report = current_report()
+    # attrs survive selecting columns too, so check the columns are actually still there
+    if all(data.attrs.get('indicators') == key and set(columns).issubset(data.columns)
+           for data in portfolio.values()):
+        report.count('indicators_reused')
+        return
+    needs_volume = bool(_needed(columns) & {'Intensity', 'Volume Indicator'})
+    with report.stage('indicators'):
+        ind = bollinger_indicators(_stack(portfolio, 'close'),
+                                   _stack(portfolio, 'high') if needs_volume else None,
+                                   _stack(portfolio, 'low') if needs_volume else None,
+                                   _stack(portfolio, 'volume') if needs_volume else None,
+                                   window, width, bandwidth_window, columns=columns)
+        for i, data in enumerate(portfolio.values()):
+            n = len(data)
+            for column, values in ind.items():
+                if lean and column in FLAG_COLUMNS:
+                    # The first rows of Thin Band Indicator are NaN, which was never a 1 anyway
+                    set_column(data, column, np.nan_to_num(values[:n, i]).astype(np.int8))
+                else:
+                    set_column(data, column, values[:n, i])
+            data.attrs['indicators'] = key
+    report.count('indicator_rows', sum(len(data) for data in portfolio.values()))
+
+
+class _RollingMoments:
+    """
+    Rolling mean and sample variance of a stream of values, O(1) per value using Welford's update for a window that
+    slides (add the new value, take out the one leaving). Like the batch functions the result is NaN unless every
+    value in the window is finite.
+    """
+    def __init__(self, window):
+        self.window = window
+        # Ring buffer of the window, non-finite values are kept as 0 so the running sums stay finite
+        self.values = [0.0] * window
+        self.seen = 0
+        self.last_bad = -1
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def add(self, x):
+        if not math.isfinite(x):
+            self.last_bad = self.seen
+            x = 0.0
+        slot = self.seen % self.window
+        old = self.values[slot]
+        self.values[slot] = x
+        self.seen += 1
+        if self.seen <= self.window:
+            delta = x - self.mean
+            self.mean += delta / self.seen
+            self.m2 += delta * (x - self.mean)
+        else:
+            old_mean = self.mean
+            self.mean += (x - old) / self.window
+            self.m2 += (x - old) * (x - self.mean + old - old_mean)
+
+    def ready(self):
+        return self.seen >= self.window and self.last_bad < self.seen - self.window
+
+    def value(self):
+        return self.mean if self.ready() else np.nan
+
+    def var(self):
+        if not self.ready() or self.window < 2:
+            return np.nan
+        return max(self.m2, 0.0) / (self.window - 1)
+
+
+class _RollingExtreme:
+    """
+    Rolling max (or min) of a stream of values, O(1) amortised per value with a monotonic deque
+    """
+    def __init__(self, window, maximum=True):
+        self.window = window
+        self.maximum = maximum
+        self.deque = deque()
+        self.seen = 0
+        self.last_bad = -1
+
+    def add(self, x):
+        i = self.seen
+        self.seen += 1
+        if not math.isfinite(x):
+            self.last_bad = i
+        else:
+            # Anything the new value beats can never be the extreme again
+            while self.deque and (self.deque[-1][1] <= x if self.maximum else self.deque[-1][1] >= x):
+                self.deque.pop()
+            self.deque.append((i, x))
+        while self.deque and self.deque[0][0] <= i - self.window:
+            self.deque.popleft()
+
+    def value(self):
+        if self.seen < self.window or self.last_bad >= self.seen - self.window:
+            return np.nan
+        return self.deque[0][1]
+
+
+class BollingerState:
+    """
+    The Bollinger Band indicator set of one ticker updated a bar at a time, for running a strategy on bars as they
+    arrive. Only the last few values of each window are kept so every update is O(1) whatever the length of the
+    history. Gives the same values as bollinger_indicators on the same bars.
+    """
+    def __init__(self, window=20, width=2, bandwidth_window=125):
+        self.width = width
+        # Number of bars it takes for every window to fill, feeding this many bars of history is enough
+        self.warmup = max(window + bandwidth_window + 4, window + 21, 50)
+        self._close = _RollingMoments(window)
+        self._intensity = _RollingMoments(20)
+        self._volume = _RollingMoments(50)
+        self._bandwidth_high = _RollingExtreme(bandwidth_window, maximum=True)
+        self._bandwidth_low = _RollingExtreme(bandwidth_window, maximum=False)
+        self._thin_band = _RollingExtreme(5, maximum=True)
+        self._trend = _RollingMoments(5)
+        self._trend_of_trend = _RollingMoments(15)
+        self._last_ma = np.nan
+        self._last_trend = np.nan
+
+    def update(self, close, high, low, volume):
+        """
+        Adds one bar
+        :return: {column name: value} for the bar, same columns and order as bollinger_indicators
+        """
+        close, high, low, volume = np.float64(close), np.float64(high), np.float64(low), np.float64(volume)
+        ind = {}
+        with np.errstate(invalid='ignore', divide='ignore'):
+            self._close.add(close)
+            ind['ma'] = np.float64(self._close.value())
+            ind['std'] = np.sqrt(self._close.var())
+            ind['Bollinger High'] = ind['ma'] + self.width * ind['std']
+            ind['Bollinger Low'] = ind['ma'] - self.width * ind['std']
+            self._intensity.add((close * 2 - high - low) / ((high - low) * volume))
+            ind['Intensity'] = self._intensity.value()
+            self._volume.add(volume)
+            ind['Volume Indicator'] = 100 * volume / np.float64(self._volume.value())
+            ind['perc_b'] = (close - ind['Bollinger Low']) / (ind['Bollinger High'] - ind['Bollinger Low'])
+            ind['BandWidth'] = (ind['Bollinger High'] - ind['Bollinger Low']) / ind['ma']
+            self._bandwidth_high.add(ind['BandWidth'])
+            self._bandwidth_low.add(ind['BandWidth'])
+            ind['BandWidth High'] = self._bandwidth_high.value()
+            ind['BandWidth Low'] = self._bandwidth_low.value()
+            ind['Thin Band Touch'] = 1 if ind['BandWidth'] < 1.1 * ind['BandWidth Low'] else 0
+            self._thin_band.add(ind['Thin Band Touch'])
+            ind['Thin Band Indicator'] = self._thin_band.value()
+            ind['Thick Band Indicator'] = 1 if ind['BandWidth'] > 0.8 * ind['BandWidth High'] else 0
+            self._trend.add(ind['ma'] - self._last_ma)
+            self._last_ma = ind['ma']
+            ind['Trend'] = self._trend.value()
+            self._trend_of_trend.add(ind['Trend'] - self._last_trend)
+            self._last_trend = ind['Trend']
+            ind['Trend of Trend'] = self._trend_of_trend.value()
+        return ind
+
+    def feed(self, close, high, low, volume):
+        """
+        Adds a run of bars (e.g. the end of the history) without keeping the values
+        """
+        for bar in zip(close, high, low, volume):
+            self.update(*bar)
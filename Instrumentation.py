@@ -0,0 +1,197 @@
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+
+
+class _NullStage:
+    """
+    What stage gives back when reporting is off, entering and leaving it does nothing
+    """
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+class _Stage:
+    __slots__ = ('report', 'name', 'key', 'start')
+
+    def __init__(self, report, name, key):
+        self.report = report
+        self.name = name
+        self.key = key
+
+    def __enter__(self):
+        # A new tuple is swapped in rather than appending, so the profiler thread always sees a whole one
+        self.report._active += (self.name,)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.start
+        report = self.report
+        report._active = report._active[:-1]
+        totals = report.stages[self.name]
+        totals[0] += elapsed
+        totals[1] += 1
+        if self.key is not None:
+            report.per_key[self.name][self.key] += elapsed
+        return False
+
+
+class RunReport:
+    """
+    Collects where the time goes in a run: how long each stage takes (in total and per ticker), counters such as rows
+    processed, trades and tickers dropped, and optionally a sampling profile of which functions are running.
+    The DataManager, the indicators and BaseStrategy report to whichever RunReport is active:
+
+        with RunReport(profile_interval=0.005) as report:
+            data = dm.prepare_data(dm.get_one_sector_SP('Energy'))
+            Analyzer(BBStopLoss(data, params))
+        report.print_summary()
+
+    When no report is active they get a disabled one, which costs a function call per stage and nothing else.
+    Work done inside worker processes isn't seen, only the time spent waiting for it.
+    """
+    def __init__(self, enabled=True, profile_interval=None):
+        """
+        :param enabled: False for a report that records nothing
+        :param profile_interval: Seconds between profiler samples of the thread that activated the report, None for
+                                 no profiling
+        """
+        self.enabled = enabled
+        self.profile_interval = profile_interval
+        # {stage: [seconds, calls]} and {stage: {key (e.g. ticker): seconds}}
+        self.stages = defaultdict(lambda: [0.0, 0])
+        self.per_key = defaultdict(lambda: defaultdict(float))
+        self.counters = Counter()
+        self.samples = 0
+        self.self_samples = Counter()
+        self.cumulative_samples = Counter()
+        self.stage_samples = Counter()
+        # The stages currently open, innermost last. Only ever replaced, never changed in place (see _sample)
+        self._active = ()
+        self._profiler = None
+        self._stop = threading.Event()
+
+    def stage(self, name, key=None):
+        """
+        Context manager timing a stage
+        :param key: Also attribute the time to this key within the stage, e.g. the ticker
+        """
+        if not self.enabled:
+            return _NULL_STAGE
+        return _Stage(self, name, key)
+
+    def count(self, name, n=1):
+        if self.enabled:
+            self.counters[name] += n
+
+    def __enter__(self):
+        _reports.append(self)
+        if self.enabled and self.profile_interval:
+            self.start_profiler(threading.get_ident())
+        return self
+
+    def __exit__(self, *exc):
+        self.stop_profiler()
+        _reports.remove(self)
+        return False
+
+    def start_profiler(self, thread_id=None):
+        """
+        Starts a background thread which every profile_interval looks at the stack of thread_id (defaults to the
+        calling thread) and counts the functions on it
+        """
+        if self._profiler is not None:
+            return
+        thread_id = thread_id if thread_id is not None else threading.get_ident()
+        self._stop.clear()
+        self._profiler = threading.Thread(target=self._sample, args=(thread_id, self.profile_interval or 0.005),
+                                          daemon=True)
+        self._profiler.start()
+
+    def stop_profiler(self):
+        if self._profiler is not None:
+            self._stop.set()
+            self._profiler.join()
+            self._profiler = None
+
+    def _sample(self, thread_id, interval):
+        while not self._stop.wait(interval):
+            frame = sys._current_frames().get(thread_id)
+            if frame is None:
+                continue
+            self.samples += 1
+            # Read the tuple once, stage() may swap in another one while we look at it
+            active = self._active
+            self.stage_samples[active[-1] if active else None] += 1
+            self.self_samples[_describe(frame)] += 1
+            seen = set()
+            while frame is not None:
+                seen.add(_describe(frame))
+                frame = frame.f_back
+            self.cumulative_samples.update(seen)
+
+    def summary(self, top=15):
+        """
+        :return: The report as a dict of plain values, see save
+        """
+        summary = {'stages': {name: {'seconds': seconds, 'calls': calls}
+                              for name, (seconds, calls) in self.stages.items()},
+                   'per_key': {name: dict(keys) for name, keys in self.per_key.items()},
+                   'counters': dict(self.counters)}
+        if self.samples:
+            summary['profile'] = {'interval': self.profile_interval, 'samples': self.samples,
+                                  'by_stage': {str(name): n for name, n in self.stage_samples.items()},
+                                  'self': self.self_samples.most_common(top),
+                                  'cumulative': self.cumulative_samples.most_common(top)}
+        return summary
+
+    def save(self, path):
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump(self.summary(), f, indent=2)
+
+    def print_summary(self, top=10):
+        summary = self.summary(top)
+        print("Stages:")
+        for name, stage in sorted(summary['stages'].items(), key=lambda item: -item[1]['seconds']):
+            print("  {:<20} {:9.3f}s {:8d} calls".format(name, stage['seconds'], stage['calls']))
+            keys = summary['per_key'].get(name)
+            if keys:
+                slowest = sorted(keys.items(), key=lambda item: -item[1])[:3]
+                print("  {:<20} slowest: {}".format('', ', '.join('{} {:.3f}s'.format(k, s) for k, s in slowest)))
+        print("Counters:")
+        for name, n in sorted(summary['counters'].items()):
+            print("  {:<30} {}".format(name, n))
+        if 'profile' in summary:
+            print("Profile ({} samples):".format(summary['profile']['samples']))
+            for function, n in summary['profile']['self']:
+                print("  {:5.1f}% {}".format(100 * n / summary['profile']['samples'], function))
+
+
+def _describe(frame):
+    code = frame.f_code
+    return '{}:{} {}'.format(os.path.basename(code.co_filename), code.co_firstlineno, code.co_name)
+
+
+# The reports that are active, the most recent one gets everything
+_reports = []
+DISABLED = RunReport(enabled=False)
+
+
+def current_report():
+    """
+    :return: The active RunReport, or a disabled one if there isn't one
+    """
+    return _reports[-1] if _reports else DISABLED
@@ -3,7 +3,8 @@ import numpy as np
 import pandas as pd
 from BBStopLoss import BBStopLoss
 from Analyzer import Analyzer
-import matplotlib.pyplot as plt
+from MCStats import MCStats
+from utils import to_datetime64, worker_pool, worker_state
 
 
 class MCAnalyze:
@@ -29,82 +30,188 @@ class MCAnalyze:
         self.portfolio = data
         self.strat = strat
         self.params = params
+        # The drift and volatility of each ticker only need working out once, not every iteration
+        self.stats = self._portfolio_stats(self.portfolio)
         self.real_strat = strat(self.portfolio, self.params)
         self.real_returns = Analyzer(self.real_strat).get_returns()
 
-    def _generate_random_portfolio(self, portfolio):
+    def _portfolio_stats(self, portfolio):
         """
-        This generates a "what-if" portfolio similar to that of the input portfolio but where at every timestep the
-        returns are randomised within paramaters set by the initial data.
-        I.e it the randomised data will have the same std and drift as the original.
-        This is used in monte carlo analysis
+        Works out the properties of each ticker the "what-if" portfolios are generated from. Based off this article
+        https://www.quantnews.com/introduction-monte-carlo-simulation/
+        :return: dict of arrays with one entry per ticker, plus the columns which are copied over unchanged
         """
-        mc_portfolio = {}
+        stats = {'tickers': list(portfolio.keys()), 'drift': [], 'std': [], 'close_open_diff_std': [], 'c0': [],
+                 'o0': [], 'days': [], 'base': {}}
         for tckr, data in portfolio.items():
-            # The code below just creates this "what-if" portfolio. Based off this article
-            # https://www.quantnews.com/introduction-monte-carlo-simulation/
             log_returns = np.log(1+data['close'].pct_change())
-            close_open_diff_std = np.nanstd((data['close'].values - data['open'].values) / data['close'].values)
             u = log_returns.mean()
             var = log_returns.var()
-            drift = u - (0.5 * var)
-            std = log_returns.std()
-            days = len(data)
-            daily_returns = np.exp(drift + std * np.random.normal(loc=0, scale=1, size=days))
-            c0 = data['close'].iloc[0]
-            o0 = data['open'].iloc[0]
-            close_prices = np.zeros(days)
-            close_prices[0] = c0
-            for d in range(1, days):
-                close_prices[d] = close_prices[d - 1] * daily_returns[d]
-            open_prices = close_prices[:-1] * (1 + np.random.normal(loc=0, scale=close_open_diff_std, size=days-1))
-            open_prices = np.concatenate((np.array([o0]), open_prices))
+            stats['drift'].append(u - (0.5 * var))
+            stats['std'].append(log_returns.std())
+            stats['close_open_diff_std'].append(
+                np.nanstd((data['close'].values - data['open'].values) / data['close'].values))
+            stats['c0'].append(data['close'].iloc[0])
+            stats['o0'].append(data['open'].iloc[0])
+            stats['days'].append(len(data))
             # This needs work as currently fills in with real values if no ability to make up yet
-            df = pd.DataFrame({'date': data['date'], 'open': open_prices, 'close': close_prices,
-                               'high': data['high'], 'low': data['low'], 'volume': data['volume'],
-                               'split_coefficient': data['split_coefficient']})
-            mc_portfolio[tckr] = df
-        return mc_portfolio
+            # Kept in the compact dtypes of lean data (see DataManager.prepare_data), every iteration copies them
+            stats['base'][tckr] = {'date': to_datetime64(data['date'].values)}
+            stats['base'][tckr].update({col: data[col].values.astype(np.float32)
+                                        for col in ['high', 'low', 'volume', 'split_coefficient']})
+        for key in ['drift', 'std', 'close_open_diff_std', 'c0', 'o0']:
+            stats[key] = np.array(stats[key], dtype=np.float64)
+        stats['days'] = np.array(stats['days'], dtype=np.int64)
+        return stats
 
-    def run_MC(self, iterations=50):
+    def run_MC(self, iterations=50, seed=None, workers=1, stop_alpha=None, stop_width=None, min_iterations=20):
         """
         This runs the actual monte carlo simulation for the desired number of iterations
+        :param seed: Seed for the random numbers. Every iteration gets its own stream derived from it, so the result
+                     is the same whatever the number of workers
+        :param workers: Number of processes to spread the iterations over
+        :param stop_alpha: Stop early once the p-value interval is clearly above or below this significance level
+        :param stop_width: Stop early once the p-value interval is narrower than this
+        :param min_iterations: Never stop early before this many iterations
+        :return: MCStats of the simulated returns, also kept as self.results
         """
-        # Number of times the true result beats the randomised data
-        success = 0
-        # plt.title("Monte Carlo Plot")
-        # plt.ylabel("Close Price")
-        # plt.xlabel("Days")
-        # plt.plot(self.portfolio['APA']['close'].values, linewidth=5, label="Real Data", zorder=100)
-        for i in range(0, iterations):
-            # Generate Fake Data
-            temp_portfolio = self._generate_random_portfolio(self.portfolio)
-            # Prepare Fake Data
-            fake_data = dm.prepare_data(temp_portfolio)
-            plt.plot(fake_data['APA']['close'].values)
-            # Run the Strategy on Fake Data
-            strat = self.strat(fake_data, params={'stop_loss_perc': 1})
-            # Get Returns on Fake Data
-            analyzer = Analyzer(strat)
-            fake_returns = analyzer.get_returns()
-            # Compare Fake returns to real returns
-            if fake_returns <= self.real_returns:
-                success += 1
-            print("Iteration {}/{}".format(i+1, iterations))
-        # plt.legend()
-        # plt.show()
-        print("This strategy beats random {}% of the time".format(100 * (success) / iterations))
+        self.results = MCStats(self.real_returns)
+        seeds = np.random.SeedSequence(seed).spawn(iterations)
+        # Iterations are handed out in blocks so each worker can generate a block of paths at once
+        block = max(1, min(32, iterations // (4 * max(1, workers))))
+        if stop_alpha is not None or stop_width is not None:
+            # Smaller blocks so the stopping rule is checked often
+            block = min(block, max(1, min_iterations // 2))
+        blocks = [seeds[i:i + block] for i in range(0, iterations, block)]
+        if workers is None or workers <= 1:
+            self._collect((_simulate(self.strat, self.params, self.stats, seeds_block) for seeds_block in blocks),
+                          iterations, stop_alpha, stop_width, min_iterations)
+        else:
+            # The portfolio statistics are sent to each worker once, not with every block
+            with worker_pool(workers, {'strat': self.strat, 'params': self.params, 'stats': self.stats}) as executor:
+                futures = [executor.submit(_simulate_in_worker, seeds_block) for seeds_block in blocks]
+                # Blocks are collected in order and the stopping rule is checked after every iteration, so stopping
+                # early gives the same answer for any workers
+                self._collect((future.result() for future in futures), iterations, stop_alpha, stop_width,
+                              min_iterations)
+                for future in futures:
+                    future.cancel()
+        if self.results.count < iterations:
+            print("Stopped early after {} iterations".format(self.results.count))
+        low, high = self.results.p_value_interval()
+        print("This strategy beats random {}% of the time".format(100 * (self.results.success) / self.results.count))
+        print("p-value {:.4f} ({:.4f} - {:.4f})".format(self.results.p_value, low, high))
+        return self.results
+
+    def _collect(self, results, iterations, stop_alpha, stop_width, min_iterations):
+        """
+        Adds the returns of each block to self.results until they run out or the stopping rule says stop. The rule is
+        checked after every iteration (not every block, whose size depends on the workers) and the rest of the block
+        is thrown away
+        """
+        for returns in results:
+            for fake_returns in returns:
+                self.results.add(fake_returns)
+                if self.results.should_stop(stop_alpha, stop_width, min_iterations):
+                    print("Iteration {}/{}".format(self.results.count, iterations))
+                    return
+            print("Iteration {}/{}".format(self.results.count, iterations))
+
+def _generate_paths(stats, seeds, chunk_size=None, max_bytes=256 * 1024 ** 2):
+    """
+    Generates the randomised close and open prices of every ticker, a chunk of iterations at a time so the memory
+    used stays bounded. The shocks of an iteration are drawn in one go from that iteration's own seed and the close
+    prices are a cumulative sum of the log returns rather than a loop over the days.
+    The four (iterations in chunk, tickers, days) float64 arrays (close, open and the two sets of shocks) are
+    allocated once and reused by every chunk, everything else is worked out in place. So max_bytes bounds all the
+    memory used here, and the arrays of a chunk are overwritten by the next one.
+    :param stats: MCAnalyze._portfolio_stats
+    :param seeds: One numpy SeedSequence per iteration
+    :param chunk_size: Iterations per chunk, defaults to as many as fit in max_bytes
+    :return: generator of (close, open) arrays of shape (iterations in chunk, tickers, days)
+    """
+    tickers = len(stats['tickers'])
+    days = stats['days'].max() if tickers else 0
+    if chunk_size is None:
+        chunk_size = max(1, max_bytes // max(1, 4 * 8 * tickers * days))
+    chunk_size = max(1, min(chunk_size, len(seeds)))
+    drift = stats['drift'][:, None]
+    std = stats['std'][:, None]
+    close_buffer = np.empty((chunk_size, tickers, days))
+    open_buffer = np.empty_like(close_buffer)
+    shocks_buffer = np.empty((chunk_size, tickers, max(days - 1, 0)))
+    open_shocks_buffer = np.empty_like(shocks_buffer)
+    for start in range(0, len(seeds), chunk_size):
+        chunk_seeds = seeds[start:start + chunk_size]
+        count = len(chunk_seeds)
+        close = close_buffer[:count]
+        open_prices = open_buffer[:count]
+        shocks = shocks_buffer[:count]
+        open_shocks = open_shocks_buffer[:count]
+        for j, seed in enumerate(chunk_seeds):
+            rng = np.random.default_rng(seed)
+            shocks[j] = rng.standard_normal((tickers, days - 1))
+            open_shocks[j] = rng.standard_normal((tickers, days - 1))
+        shocks *= std
+        shocks += drift
+        np.cumsum(shocks, axis=2, out=shocks)
+        np.exp(shocks, out=shocks)
+        close[:, :, 0] = stats['c0']
+        np.multiply(stats['c0'][:, None], shocks, out=close[:, :, 1:])
+        open_shocks *= stats['close_open_diff_std'][:, None]
+        open_shocks += 1
+        open_prices[:, :, 0] = stats['o0']
+        np.multiply(close[:, :, :-1], open_shocks, out=open_prices[:, :, 1:])
+        yield close, open_prices
+
+
+def _generate_random_portfolio(stats, close, open_prices):
+    """
+    This generates a "what-if" portfolio similar to that of the input portfolio but where at every timestep the
+    returns are randomised within paramaters set by the initial data.
+    I.e it the randomised data will have the same std and drift as the original.
+    This is used in monte carlo analysis
+    :param close: (tickers, days) close prices of one iteration from _generate_paths
+    :param open_prices: (tickers, days) open prices of the same iteration
+    """
+    mc_portfolio = {}
+    for i, tckr in enumerate(stats['tickers']):
+        days = stats['days'][i]
+        base = stats['base'][tckr]
+        mc_portfolio[tckr] = pd.DataFrame({'date': base['date'], 'open': open_prices[i, :days],
+                                           'close': close[i, :days], 'high': base['high'], 'low': base['low'],
+                                           'volume': base['volume'], 'split_coefficient': base['split_coefficient']})
+    return mc_portfolio
+
+
+def _simulate(strat, params, stats, seeds):
+    """
+    Runs the strategy on the "what-if" portfolio of each seed
+    :return: list of the returns of each iteration
+    """
+    dm = DataManager()
+    returns = []
+    for close, open_prices in _generate_paths(stats, seeds):
+        for j in range(len(close)):
+            # Generate and prepare fake data
+            fake_data = dm.prepare_data(_generate_random_portfolio(stats, close[j], open_prices[j]), lean=True)
+            # Run the Strategy on Fake Data and get the returns
+            returns.append(Analyzer(strat(fake_data, params)).get_returns())
+    return returns
 
 
+def _simulate_in_worker(seeds):
+    state = worker_state()
+    return _simulate(state['strat'], state['params'], state['stats'], seeds)
 
 if __name__=='__main__':
     # Example of how to use the MC Simulation
     path_to_data = 'C:\\Users\\petem\\Trading\\Data\\S&P\\'
-    dm = DataManager(path_to_data=path_to_data)
+    path_to_cache = 'C:\\Users\\petem\\Trading\\Data\\Cache\\'
+    dm = DataManager(path_to_data=path_to_data, path_to_cache=path_to_cache)
     sectors = ["Communication Services", "Consumer Discretionary", "Consumer Staples", "Energy", "Financials",
                "Health Care", "Industrials", "Information Technology", "Materials", "Real Estate", "Utilities"]
-    data = dm.get_one_sector_SP(sector=sectors[3], fromDate="2015-06-01", toDate="2018-01-01")
-    data = dm.prepare_data(data_dict=data)
+    data = dm.load_prepared(sector=sectors[3], fromDate="2015-06-01", toDate="2018-01-01")
     params = {'stop_loss_perc': 1}
     mc = MCAnalyze(BBStopLoss, data, params)
-    mc.run_MC(50)
\ No newline at end of file
+    mc.run_MC(1000, seed=7, workers=4, stop_alpha=0.05)
\ No newline at end of file
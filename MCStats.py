@@ -0,0 +1,147 @@
+import math
+from statistics import NormalDist
+import numpy as np
+
+
+class _P2Quantile:
+    """
+    Streaming estimate of one quantile using the P-square algorithm (Jain & Chlamtac), five markers so the memory
+    used doesn't grow with the number of values.
+    """
+    def __init__(self, q):
+        self.q = q
+        self.heights = []
+        self.positions = [1, 2, 3, 4, 5]
+        self.desired = [1, 1 + 2 * q, 1 + 4 * q, 3 + 2 * q, 5]
+        self.increments = [0, q / 2, q, (1 + q) / 2, 1]
+
+    def add(self, x):
+        h = self.heights
+        if len(h) < 5:
+            h.append(x)
+            h.sort()
+            return
+        if x < h[0]:
+            h[0] = x
+            k = 0
+        elif x >= h[4]:
+            h[4] = x
+            k = 3
+        else:
+            k = next(i for i in range(4) if h[i] <= x < h[i + 1])
+        for i in range(k + 1, 5):
+            self.positions[i] += 1
+        for i in range(5):
+            self.desired[i] += self.increments[i]
+        for i in range(1, 4):
+            d = self.desired[i] - self.positions[i]
+            if (d >= 1 and self.positions[i + 1] - self.positions[i] > 1) or \
+                    (d <= -1 and self.positions[i - 1] - self.positions[i] < -1):
+                d = 1 if d > 0 else -1
+                n = self.positions
+                # Parabolic prediction, falling back to linear if it would break the ordering
+                new = h[i] + d / (n[i + 1] - n[i - 1]) * (
+                    (n[i] - n[i - 1] + d) * (h[i + 1] - h[i]) / (n[i + 1] - n[i])
+                    + (n[i + 1] - n[i] - d) * (h[i] - h[i - 1]) / (n[i] - n[i - 1]))
+                if not h[i - 1] < new < h[i + 1]:
+                    new = h[i] + d * (h[i + d] - h[i]) / (n[i + d] - n[i])
+                h[i] = new
+                n[i] += d
+
+    def value(self):
+        if not self.heights:
+            return np.nan
+        if len(self.heights) < 5:
+            # Not enough values for the markers yet, just use the values themselves
+            return float(np.quantile(self.heights, self.q))
+        return self.heights[2]
+
+
+class MCStats:
+    """
+    Keeps running statistics of the simulated returns of a Monte Carlo run without storing them: the mean and
+    variance (Welford), a few quantiles (P-square) and how often the random portfolios do at least as well as the
+    real returns, which is the p-value of the strategy.
+    """
+    def __init__(self, real_returns, quantiles=(0.05, 0.25, 0.5, 0.75, 0.95), confidence=0.95):
+        """
+        :param real_returns: The returns of the strategy on the real data
+        :param quantiles: The quantiles of the simulated returns to track
+        :param confidence: Confidence level of the p-value interval
+        """
+        self.real_returns = real_returns
+        self.confidence = confidence
+        self.count = 0
+        self.mean = 0.0
+        self._m2 = 0.0
+        # Number of times the true result beats (or equals) the randomised data
+        self.success = 0
+        # Number of times the randomised data does at least as well as the true result
+        self.as_good = 0
+        self._quantiles = {q: _P2Quantile(q) for q in quantiles}
+
+    def add(self, value):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (value - self.mean)
+        if value <= self.real_returns:
+            self.success += 1
+        if value >= self.real_returns:
+            self.as_good += 1
+        for estimator in self._quantiles.values():
+            estimator.add(value)
+
+    @property
+    def var(self):
+        return self._m2 / (self.count - 1) if self.count > 1 else np.nan
+
+    @property
+    def std(self):
+        return math.sqrt(self.var) if self.count > 1 else np.nan
+
+    def quantile(self, q):
+        return self._quantiles[q].value()
+
+    @property
+    def p_value(self):
+        """
+        Chance of random data doing at least as well as the real data, with the usual +1 so it is never 0
+        """
+        return (self.as_good + 1) / (self.count + 1)
+
+    def p_value_interval(self):
+        """
+        Wilson score interval of the p-value at self.confidence
+        """
+        if self.count == 0:
+            return 0.0, 1.0
+        z = NormalDist().inv_cdf(0.5 + self.confidence / 2)
+        n = self.count
+        p = self.as_good / n
+        centre = (p + z * z / (2 * n)) / (1 + z * z / n)
+        half = z * math.sqrt(p * (1 - p) / n + z * z / (4 * n * n)) / (1 + z * z / n)
+        return max(0.0, centre - half), min(1.0, centre + half)
+
+    def should_stop(self, alpha=None, width=None, min_iterations=20):
+        """
+        Sequential stopping rule, True once the answer is clear enough that more iterations won't change it
+        :param alpha: Stop when the p-value interval is entirely above or below this significance level
+        :param width: Stop when the p-value interval is narrower than this
+        :param min_iterations: Never stop before this many iterations
+        """
+        if self.count < min_iterations or (alpha is None and width is None):
+            return False
+        low, high = self.p_value_interval()
+        if alpha is not None and (high < alpha or low > alpha):
+            return True
+        return width is not None and high - low < width
+
+    def summary(self):
+        low, high = self.p_value_interval()
+        summary = {'iterations': self.count, 'real_returns': self.real_returns, 'mean': self.mean, 'std': self.std,
+                   'success_rate': self.success / self.count if self.count else np.nan, 'p_value': self.p_value,
+                   'p_value_low': low, 'p_value_high': high}
+        for q in self._quantiles:
+            summary['q{}'.format(q)] = self.quantile(q)
+        return summary
@@ -0,0 +1,149 @@
+import numpy as np
+import pandas as pd
+
+"""
+Performance metrics worked out straight from the TradeLedger arrays in a few numpy passes, no DataFrames are built,
+so they are cheap enough to call for every run of a parameter sweep or Monte Carlo simulation.
+The trade based metrics treat the return of a trade as landing on its close date and add them up like
+Analyzer.get_returns, so the equity curve is 1 + the cumulative sum of the returns. Trading days without a close
+count as a return of 0.
+"""
+
+
+def _drawdown(equity, positions, relative=True):
+    """
+    :param equity: Equity curve, starting from the peak it is measured against
+    :param positions: Position of each point in time (e.g. trading day number), for the duration
+    :param relative: Drawdown as a fraction of the peak, otherwise as the fall in equity
+    :return: max drawdown (negative) and the longest time from a peak until it is regained (or the end if it never is)
+    """
+    peaks = np.maximum.accumulate(equity)
+    if relative:
+        with np.errstate(invalid='ignore', divide='ignore'):
+            drawdowns = np.where(peaks > 0, equity / peaks - 1, np.nan)
+    else:
+        drawdowns = equity - peaks
+    highs = np.flatnonzero(equity >= peaks)
+    # Time between consecutive highs that had a drawdown in between, plus the time since the last high
+    gaps = np.diff(highs)
+    durations = (positions[highs[1:]] - positions[highs[:-1]])[gaps > 1]
+    if highs[-1] != len(equity) - 1:
+        durations = np.append(durations, positions[-1] - positions[highs[-1]])
+    max_drawdown = np.nanmin(drawdowns) if np.isfinite(drawdowns).any() else np.nan
+    return min(max_drawdown, 0.0), int(durations.max()) if len(durations) else 0
+
+
+def _ratios(total, total_squares, downside_squares, periods, periods_per_year):
+    """
+    Sharpe and Sortino from sums over the periods, so periods with no return don't have to be stored
+    """
+    if periods < 2:
+        return np.nan, np.nan
+    mean = total / periods
+    var = max(total_squares - periods * mean * mean, 0.0) / (periods - 1)
+    downside = np.sqrt(downside_squares / periods)
+    sharpe = mean / np.sqrt(var) * np.sqrt(periods_per_year) if var > 0 else np.nan
+    sortino = mean / downside * np.sqrt(periods_per_year) if downside > 0 else np.nan
+    return sharpe, sortino
+
+
+def _profit_factor(returns):
+    losses = -returns[returns < 0].sum()
+    gains = returns[returns > 0].sum()
+    if losses > 0:
+        return gains / losses
+    return np.inf if gains > 0 else np.nan
+
+
+def trade_metrics(ledger, periods_per_year=252, symbols=None):
+    """
+    :param ledger: TradeLedger of the strategy (strat.ledger)
+    :param periods_per_year: Trading days in a year, for annualising Sharpe/Sortino
+    :param symbols: Number of symbols the strategy could trade, for the exposure. Defaults to the number traded
+    :return: dict of total_return, trades, sharpe, sortino, max_drawdown (the biggest fall in the summed returns
+             from a peak), drawdown_duration (trading days),
+             win_rate, profit_factor, exposure (fraction of the time symbols had a position open), avg_days_held and
+             trades_per_year
+    """
+    returns = ledger.rets['return']
+    metrics = {'total_return': returns.sum(), 'trades': len(returns)}
+    if not len(returns):
+        metrics.update({'sharpe': np.nan, 'sortino': np.nan, 'max_drawdown': 0.0, 'drawdown_duration': 0,
+                        'win_rate': np.nan, 'profit_factor': np.nan, 'exposure': 0.0, 'avg_days_held': np.nan,
+                        'trades_per_year': 0.0})
+        return metrics
+    # The ledger stores dates as ids in the order they were first seen, rank them by time
+    dates = np.array(ledger.dates, dtype='datetime64[D]')
+    order = np.argsort(dates, kind='stable')
+    rank = np.empty(len(order), dtype=np.int64)
+    rank[order] = np.arange(len(order))
+    dates = dates[order]
+    daily = np.bincount(rank[ledger.rets['close_date']], weights=returns, minlength=len(dates))
+    positions = np.busday_count(dates[0], dates)
+    periods = max(int(positions[-1]) + 1, len(dates))
+    metrics['sharpe'], metrics['sortino'] = _ratios(daily.sum(), np.dot(daily, daily),
+                                                     np.dot(np.minimum(daily, 0), np.minimum(daily, 0)),
+                                                     periods, periods_per_year)
+    equity = np.concatenate([[1.0], 1 + np.cumsum(daily)])
+    metrics['max_drawdown'], metrics['drawdown_duration'] = _drawdown(equity, np.concatenate([[0], positions]),
+                                                                      relative=False)
+    days_held = ledger.days_held()
+    span = max(int((dates[-1] - dates[0]).astype(np.int64)), 1)
+    if symbols is None:
+        symbols = len(np.unique(ledger.rets['symbol']))
+    metrics['win_rate'] = np.count_nonzero(returns > 0) / len(returns)
+    metrics['profit_factor'] = _profit_factor(returns)
+    metrics['exposure'] = days_held.sum() / (span * symbols)
+    metrics['avg_days_held'] = days_held.mean()
+    metrics['trades_per_year'] = len(returns) / (span / 365.25)
+    return metrics
+
+
+def equity_metrics(equity, periods_per_year=252):
+    """
+    Metrics of a daily equity curve, e.g. PortfolioSimulator.equity['equity']
+    :return: dict of total_return, sharpe, sortino, max_drawdown and drawdown_duration (days)
+    """
+    equity = np.asarray(equity, dtype=np.float64)
+    metrics = {'total_return': equity[-1] / equity[0] - 1 if len(equity) else np.nan}
+    if len(equity) < 2:
+        metrics.update({'sharpe': np.nan, 'sortino': np.nan, 'max_drawdown': 0.0, 'drawdown_duration': 0})
+        return metrics
+    with np.errstate(invalid='ignore', divide='ignore'):
+        returns = equity[1:] / equity[:-1] - 1
+    returns = returns[np.isfinite(returns)]
+    downside = np.minimum(returns, 0)
+    metrics['sharpe'], metrics['sortino'] = _ratios(returns.sum(), np.dot(returns, returns), np.dot(downside, downside),
+                                                     len(returns), periods_per_year)
+    metrics['max_drawdown'], metrics['drawdown_duration'] = _drawdown(equity, np.arange(len(equity)))
+    return metrics
+
+
+def breakdown(ledger, sectors=None):
+    """
+    The trade metrics of each symbol, or of each sector if sectors is given
+    :param ledger: TradeLedger of the strategy
+    :param sectors: {symbol: sector}, e.g. from DataManager.index. Symbols missing from it go under Unknown
+    :return: DataFrame with a row per symbol/sector of trades, total_return, mean_return, win_rate, profit_factor
+             and avg_days_held
+    """
+    returns = ledger.rets['return']
+    names = ledger.symbols
+    if sectors is not None:
+        names = [sectors.get(symbol, 'Unknown') for symbol in names]
+    labels, groups = np.unique(np.array(names, dtype=str)[ledger.rets['symbol']], return_inverse=True)
+    size = len(labels)
+    counts = np.bincount(groups, minlength=size)
+    totals = np.bincount(groups, weights=returns, minlength=size)
+    gains = np.bincount(groups, weights=np.maximum(returns, 0), minlength=size)
+    losses = np.bincount(groups, weights=-np.minimum(returns, 0), minlength=size)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        result = pd.DataFrame({
+            'trades': counts,
+            'total_return': totals,
+            'mean_return': totals / counts,
+            'win_rate': np.bincount(groups, weights=returns > 0, minlength=size) / counts,
+            'profit_factor': np.where(losses > 0, gains / losses, np.where(gains > 0, np.inf, np.nan)),
+            'avg_days_held': np.bincount(groups, weights=ledger.days_held(), minlength=size) / counts},
+            index=pd.Index(labels, name='sector' if sectors is not None else 'symbol'))
+    return result
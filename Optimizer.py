@@ -0,0 +1,135 @@
+import itertools
+import pandas as pd
+from Analyzer import Analyzer
+from utils import worker_pool, worker_state
+
+
+class GridSearch:
+    """
+    Runs a strategy for every combination of a grid of parameters and ranks them.
+    Combinations that only differ in parameters which don't change the indicators (see the strategy's
+    indicator_params) share one set of indicators, so e.g. every stop_loss_perc and perc_b threshold tried for a
+    given window/width/bandwidth_window reuses the same rolling mean and std. With several workers the groups are
+    cut into chunks spread over the process pool, so a sweep of many thresholds on one indicator setting is run in
+    parallel too. Each worker computes a group's indicators once, the first time it gets a chunk of it.
+    """
+    def __init__(self, strat, data, param_grid, params=None, objective='returns', workers=1):
+        """
+        :param strat: The strategy as a class i.e. just as BBStopLoss not as BBStopLoss(data, params)
+        :param data: Prepared data
+        :param param_grid: {param name: list of values to try}
+        :param params: Parameters kept the same for every combination
+        :param objective: 'returns', 'sharpe' or a function taking the Analyzer and returning the score to
+                          maximise
+        :param workers: Number of processes to spread the combinations over
+        """
+        self.strat = strat
+        self.data = data
+        self.param_grid = param_grid
+        self.params = params if params is not None else {}
+        self.objective = objective
+        self.workers = workers
+        self.results = None
+
+    def combinations(self):
+        """
+        :return: list of the params dict of every combination in the grid
+        """
+        names = list(self.param_grid.keys())
+        return [dict(self.params, **dict(zip(names, values)))
+                for values in itertools.product(*[self.param_grid[name] for name in names])]
+
+    def groups(self):
+        """
+        Splits the combinations into groups which share the same indicators
+        """
+        indicator_params = self.strat.indicator_params
+        groups = {}
+        for combo in self.combinations():
+            if indicator_params is None:
+                # Don't know what the indicators depend on so everything has to be recomputed
+                key = tuple(sorted(combo.items(), key=str))
+            else:
+                key = tuple((name, combo.get(name)) for name in indicator_params)
+            groups.setdefault(key, []).append(combo)
+        return list(groups.values())
+
+    def chunks(self, groups):
+        """
+        Cuts the groups into the tasks for the process pool, about 4 per worker in total so they even out. A chunk
+        never mixes groups and they stay in order, so the results come back in the same order as running serially
+        """
+        total = sum(len(group) for group in groups)
+        size = max(1, -(-total // (4 * self.workers)))
+        return [group[start:start + size] for group in groups for start in range(0, len(group), size)]
+
+    def run(self):
+        """
+        Runs every combination
+        :return: DataFrame with one row per combination (its params, number of trades and objective), best first.
+                 Also kept as self.results
+        """
+        groups = self.groups()
+        if self.workers is None or self.workers <= 1 or sum(len(group) for group in groups) <= 1:
+            cache = {}
+            rows = [row for group in groups
+                    for row in _run_group(self.strat, self.data, group, self.objective, cache)]
+        else:
+            # The data is sent to each worker once, not with every chunk
+            with worker_pool(self.workers, {'strat': self.strat, 'data': self.data, 'objective': self.objective,
+                                            'cache': {}}) as executor:
+                rows = [row for rows in executor.map(_run_group_in_worker, self.chunks(groups)) for row in rows]
+        self.results = pd.DataFrame(rows).sort_values(by='objective', ascending=False, kind='stable')
+        self.results = self.results.reset_index(drop=True)
+        return self.results
+
+
+def score(analyzer, objective):
+    """
+    Works out the objective of a strategy which has been run by the Analyzer
+    """
+    if callable(objective):
+        return objective(analyzer)
+    if objective == 'returns':
+        return analyzer.get_returns()
+    if objective == 'sharpe':
+        return analyzer.get_sharpe()
+    raise ValueError("Unknown objective {}".format(objective))
+
+
+def indicated(strat, data, combo, cache):
+    """
+    The data with the indicators for combo computed over all of it, cached by the params they depend on
+    """
+    if strat.indicator_params is None:
+        key = tuple(sorted(combo.items(), key=str))
+    else:
+        key = tuple(combo.get(name) for name in strat.indicator_params)
+    if key not in cache:
+        # Building the strategy computes the indicators into its portfolio, data itself is left alone
+        cache[key] = strat(data, combo).portfolio
+    return cache[key]
+
+
+def _run_group(strat, data, group, objective, cache):
+    """
+    Runs (part of) a group of combinations which share their indicators, which come from the cache if they have
+    already been computed
+    """
+    # Strategies built on the indicated portfolio see the indicators are already there. Each one adds its signals
+    # to its own overlay, so nothing leaks between combinations
+    indicated_data = indicated(strat, data, group[0], cache)
+    rows = []
+    for combo in group:
+        strategy = strat(indicated_data, combo)
+        analyzer = Analyzer(strategy)
+        row = dict(combo)
+        row['trades'] = len(strategy.rets_df)
+        row['objective'] = score(analyzer, objective)
+        rows.append(row)
+    return rows
+
+
+def _run_group_in_worker(group):
+    state = worker_state()
+    return _run_group(state['strat'], state['data'], group, state['objective'], state['cache'])
@@ -0,0 +1,151 @@
+import numpy as np
+import pandas as pd
+from PricePanel import PricePanel
+from TradeLedger import TradeLedger
+
+
+class PortfolioSimulator:
+    """
+    Runs a strategy as one portfolio rather than one ticker at a time. It walks through the dates of the whole
+    universe once in time order with a limited amount of cash and a cap on the number of positions open at once, so
+    unlike summing up the returns of every trade it accounts for capital, overlapping positions and timing.
+    The entry/exit conditions are the strategy's own and orders work like BaseStrategy.run: a signal fills at the
+    next open. An entry that can't be filled (no free slot or not enough cash) is dropped.
+    Each date is a handful of numpy operations over all the tickers, there is no loop over tickers per day.
+    """
+    def __init__(self, strat, initial_cash=100000, max_positions=10, position_size=None, commission=0):
+        """
+        :param strat: An instance of the strategy, its portfolio needs to be prepared data with the indicators added
+                      (which building the strategy does)
+        :param initial_cash: Starting cash
+        :param max_positions: Most positions open at the same time
+        :param position_size: Fraction of the equity put into each new position, defaults to 1 / max_positions
+        :param commission: Cost of each fill as a fraction of its value, taken from the cash (not from the trade
+                           returns in rets_df)
+        """
+        self.strat = strat
+        self.initial_cash = initial_cash
+        self.max_positions = max_positions
+        self.position_size = position_size if position_size is not None else 1 / max_positions
+        self.commission = commission
+        self.ledger = TradeLedger()
+        self.equity = None
+        # Entries dropped because there was no free slot or not enough cash
+        self.skipped = 0
+
+    @property
+    def trans_df(self):
+        return self.ledger.trans_df
+
+    @property
+    def rets_df(self):
+        return self.ledger.rets_df
+
+    def _signals(self, panel):
+        """
+        The strategy's entry/exit conditions of every ticker lined up on the panel's dates
+        :return: long, short, exit (dates x tickers) bool arrays
+        """
+        long_entry, short_entry, exit_signal = (np.zeros(panel.shape, dtype=bool) for _ in range(3))
+        for i, (tckr, data) in enumerate(self.strat.portfolio.items()):
+            rows = np.searchsorted(panel.dates, data['date'].values)
+            entries = self.strat._entry_conditions(data)
+            long_entry[rows, i] = entries[0]
+            short_entry[rows, i] = entries[1]
+            exit_signal[rows, i] = self.strat._exit_conditions(data)
+        return long_entry, short_entry, exit_signal
+
+    def run(self):
+        """
+        Runs the simulation
+        :return: DataFrame with a row per date of the cash, the value of the positions (holdings), the equity and the
+                 number of open positions. Also kept as self.equity, the trades are in trans_df and rets_df
+        """
+        panel = PricePanel.from_dict(self.strat.portfolio, columns=['open', 'close'])
+        long_entry, short_entry, exit_signal = self._signals(panel)
+        dates = panel.dates
+        tickers = panel.tickers
+        open_prices = panel['open']
+        close = panel['close']
+        # Positions are valued at the last close a ticker had
+        marks = pd.DataFrame(close).ffill().fillna(0).values
+        use_stop_loss = self.strat.use_stop_loss
+        stop_loss_perc = self.strat.stop_loss_perc
+        n, count = panel.shape
+        direction = np.zeros(count, dtype=np.int8)
+        shares = np.zeros(count)
+        entry_price = np.full(count, np.nan)
+        stop_price = np.full(count, np.nan)
+        entry_date = np.empty(count, dtype=object)
+        pending_open = np.zeros(count, dtype=np.int8)
+        pending_close = np.zeros(count, dtype=bool)
+        signal_date = np.empty(count, dtype=object)
+        cash = float(self.initial_cash)
+        equity = cash
+        history = np.empty((n, 4))
+        for t in range(n):
+            price = open_prices[t]
+            priced = np.isfinite(price)
+            # Closes first so their cash and slots can be used by today's entries
+            closing = np.flatnonzero(pending_close & priced)
+            if len(closing):
+                value = shares[closing] * price[closing]
+                cash += np.sum(direction[closing] * value) - self.commission * np.sum(value)
+                for i in closing:
+                    self._record_close(tickers[i], signal_date[i], direction[i], entry_date[i], entry_price[i],
+                                       price[i])
+                direction[closing] = 0
+                shares[closing] = 0
+                pending_close[closing] = False
+            opening = np.flatnonzero((pending_open != 0) & priced)
+            if len(opening):
+                pending = opening
+                # Tickers in portfolio order get the free slots, then as many as the cash allows
+                opening = opening[:max(0, self.max_positions - np.count_nonzero(direction))]
+                target = self.position_size * equity
+                cost = np.where(pending_open[opening] > 0, target, 0) + self.commission * target
+                opening = opening[np.cumsum(cost) <= cash]
+                self.skipped += len(pending) - len(opening)
+                orders = pending_open[opening]
+                shares[opening] = target / price[opening]
+                cash -= np.sum(orders * target) + self.commission * target * len(opening)
+                direction[opening] = orders
+                entry_price[opening] = price[opening]
+                stop_price[opening] = (1 - orders * stop_loss_perc) * price[opening]
+                entry_date[opening] = signal_date[opening]
+                for i in opening:
+                    self.ledger.add_transaction(tickers[i], signal_date[i], int(direction[i]), 0, price[i])
+                pending_open[pending] = 0
+            holdings = np.sum(direction * shares * marks[t])
+            equity = cash + holdings
+            history[t] = cash, holdings, equity, np.count_nonzero(direction)
+            # Today's signals, filled at the next open
+            held = (direction != 0) & ~pending_close
+            closing = exit_signal[t]
+            if use_stop_loss:
+                with np.errstate(invalid='ignore'):
+                    closing = closing | (direction * close[t] < direction * stop_price)
+            closing &= held
+            pending_close |= closing
+            signal_date[closing] = dates[t]
+            flat = (direction == 0) & (pending_open == 0)
+            orders = np.where(short_entry[t], -1, np.where(long_entry[t], 1, 0)) * flat
+            opening = orders != 0
+            pending_open[opening] = orders[opening]
+            signal_date[opening] = dates[t]
+        self.equity = pd.DataFrame(history, columns=['cash', 'holdings', 'equity', 'positions'],
+                                   index=pd.Index(dates, name='date'))
+        self.equity['positions'] = self.equity['positions'].astype(np.int64)
+        return self.equity
+
+    def _record_close(self, tckr, close_date, direction, entry_date, entry_price, close_price):
+        direction = int(direction)
+        returns = (close_price / entry_price - 1) * direction
+        self.ledger.add_transaction(tckr, close_date, direction, 1, close_price)
+        self.ledger.add_return(tckr, entry_date, close_date, direction, entry_price, close_price, returns)
+
+    def get_returns(self):
+        """
+        Return of the whole portfolio over the run
+        """
+        return self.equity['equity'].iloc[-1] / self.initial_cash - 1
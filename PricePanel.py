@@ -0,0 +1,99 @@
+import numpy as np
+import pandas as pd
+
+
+class PricePanel:
+    """
+    The whole universe as one date aligned block per field instead of a {tckr: DataFrame} dict.
+    Each field is a (dates x tickers) array with the dtype the column was loaded with, column ordered so every
+    ticker's history is contiguous. Dates a ticker has no data for are NaN in float fields and 0 in the others (use
+    valid to tell them apart). Code that works across tickers on one date (e.g. PortfolioSimulator) can use the arrays
+    directly, and frame() still gives the strategies a normal DataFrame per ticker built on views of the arrays.
+    """
+    def __init__(self, fields, tickers, dates, valid=None, date_column=False, index_name=None):
+        """
+        :param fields: {field name: (dates x tickers) array}
+        :param tickers: The ticker of each column
+        :param dates: The date of each row, ascending
+        :param valid: (dates x tickers) bool array of which dates each ticker has data for, defaults to all of them
+        :param date_column: True if the frames had the date as a 'date' column (prepared data) rather than the index
+        :param index_name: Name of the date index when date_column is False
+        """
+        self.fields = fields
+        self.tickers = list(tickers)
+        self.dates = np.asarray(dates)
+        if valid is None:
+            valid = np.ones((len(self.dates), len(self.tickers)), dtype=bool, order='F')
+        self.valid = valid
+        self.date_column = date_column
+        self.index_name = index_name
+        self._positions = {tckr: i for i, tckr in enumerate(self.tickers)}
+
+    @classmethod
+    def from_dict(cls, data_dict, columns=None):
+        """
+        Builds the panel from the usual {tckr: DataFrame} dict, either straight from the loaders or after
+        prepare_data. Every numeric column is included unless columns is given.
+        """
+        tickers = list(data_dict.keys())
+        if not tickers:
+            return cls({}, [], np.array([]))
+        first = data_dict[tickers[0]]
+        date_column = 'date' in first.columns
+        ticker_dates = [np.asarray(df['date'] if date_column else df.index) for df in data_dict.values()]
+        dates = np.unique(np.concatenate(ticker_dates))
+        if columns is None:
+            columns = [col for col in first.columns if col != 'date' and pd.api.types.is_numeric_dtype(first[col])]
+        shape = (len(dates), len(tickers))
+        fields = {}
+        for col in columns:
+            dtype = np.result_type(*[df[col].dtype for df in data_dict.values()])
+            fill = np.nan if np.issubdtype(dtype, np.floating) else 0
+            fields[col] = np.full(shape, fill, dtype=dtype, order='F')
+        valid = np.zeros(shape, dtype=bool, order='F')
+        for i, (tckr, df) in enumerate(data_dict.items()):
+            rows = np.searchsorted(dates, ticker_dates[i])
+            valid[rows, i] = True
+            for col in columns:
+                fields[col][rows, i] = df[col].to_numpy()
+        return cls(fields, tickers, dates, valid, date_column, None if date_column else first.index.name)
+
+    def __getitem__(self, field):
+        return self.fields[field]
+
+    def __contains__(self, tckr):
+        return tckr in self._positions
+
+    @property
+    def shape(self):
+        return len(self.dates), len(self.tickers)
+
+    def column(self, field, tckr):
+        """
+        :return: One ticker's values of one field, a view on the panel
+        """
+        return self.fields[field][:, self._positions[tckr]]
+
+    def frame(self, tckr):
+        """
+        The ticker as a DataFrame in the same layout it was loaded in. If the ticker has every date the columns are
+        views on the panel, otherwise the missing dates are dropped (which has to copy).
+        """
+        i = self._positions[tckr]
+        rows = self.valid[:, i]
+        complete = rows.all()
+        data = {}
+        if self.date_column:
+            data['date'] = self.dates if complete else self.dates[rows]
+        for field, values in self.fields.items():
+            data[field] = values[:, i] if complete else values[rows, i]
+        if self.date_column:
+            return pd.DataFrame(data, copy=False)
+        index = pd.Index(self.dates if complete else self.dates[rows], name=self.index_name)
+        return pd.DataFrame(data, index=index, copy=False)
+
+    def to_dict(self):
+        """
+        :return: The panel as the usual {tckr: DataFrame} dict
+        """
+        return {tckr: self.frame(tckr) for tckr in self.tickers}
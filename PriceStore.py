@@ -0,0 +1,133 @@
+import json
+import os
+import numpy as np
+import pandas as pd
+
+
+class PriceStore:
+    """
+    A columnar copy of the saved S&P csv files. Parsing hundreds of csv files on every backtest is slow, so this is
+    built once from the csv directory (see DataManager.ingest_SP) and then read from instead.
+
+    The layout on disk is one .npy file per field (every ticker concatenated, each ticker sorted by date) plus a
+    meta.json which holds the index: which rows belong to which file, the symbol and sector of each file and the
+    original column order and dtypes. The arrays are memory mapped so a load only touches the requested rows/columns.
+    """
+    version = 1
+
+    def __init__(self, path_to_store):
+        self.path_to_store = path_to_store
+        self._meta = None
+        self._arrays = {}
+
+    def __getstate__(self):
+        # Memory maps are reopened rather than copied when sent to a worker process
+        state = self.__dict__.copy()
+        state['_arrays'] = {}
+        return state
+
+    def exists(self):
+        return os.path.isfile(os.path.join(self.path_to_store, 'meta.json'))
+
+    @property
+    def meta(self):
+        if self._meta is None:
+            with open(os.path.join(self.path_to_store, 'meta.json')) as f:
+                self._meta = json.load(f)
+        return self._meta
+
+    @property
+    def files(self):
+        """
+        Every filename that was in the csv directory when the store was built, in the order os.listdir gave them
+        """
+        return self.meta['files']
+
+    def _array(self, name):
+        if name not in self._arrays:
+            self._arrays[name] = np.load(os.path.join(self.path_to_store, name + '.npy'), mmap_mode='r')
+        return self._arrays[name]
+
+    def ingest(self, files, read_file, symbol_sector):
+        """
+        Builds the store.
+        :param files: All the filenames in the csv directory, in listdir order
+        :param read_file: function taking a filename and returning the full (date ascending) DataFrame for it
+        :param symbol_sector: function taking a filename and returning (symbol, sector number) or None to skip it
+        """
+        os.makedirs(self.path_to_store, exist_ok=True)
+        meta_path = os.path.join(self.path_to_store, 'meta.json')
+        # Rebuilding an existing store: drop its meta.json first so that if this stops half way through, the old
+        # index isn't left pointing at the new half written arrays. exists() is False until the new one is written
+        if os.path.exists(meta_path):
+            os.remove(meta_path)
+        self._meta = None
+        self._arrays = {}
+        entries = {}
+        columns = None
+        index_name = None
+        dates = []
+        values = []
+        start = 0
+        for filename in files:
+            parsed = symbol_sector(filename)
+            if parsed is None:
+                continue
+            df = read_file(filename)
+            if columns is None:
+                columns = list(df.columns)
+                index_name = df.index.name
+            elif list(df.columns) != columns:
+                raise ValueError("{} has columns {}, expected {}".format(filename, list(df.columns), columns))
+            file_dates = np.array(df.index.astype(str), dtype='S')
+            # Should already be ascending after the reverse but make sure so the date slicing can use searchsorted
+            order = np.argsort(file_dates, kind='stable')
+            if np.any(order != np.arange(len(order))):
+                df = df.iloc[order]
+                file_dates = file_dates[order]
+            dates.append(file_dates)
+            values.append(df)
+            entries[filename] = {'symbol': parsed[0], 'sector': parsed[1], 'start': start, 'stop': start + len(df),
+                                 'dtypes': [str(t) for t in df.dtypes]}
+            start += len(df)
+
+        if columns is None:
+            columns = []
+        np.save(os.path.join(self.path_to_store, 'date.npy'),
+                np.concatenate(dates) if dates else np.array([], dtype='S10'))
+        for i, col in enumerate(columns):
+            np.save(os.path.join(self.path_to_store, 'col{}.npy'.format(i)),
+                    np.concatenate([df.iloc[:, i].to_numpy(dtype=np.float64) for df in values]))
+        meta = {'version': self.version, 'files': list(files), 'columns': columns, 'index_name': index_name,
+                'entries': entries}
+        # Written last (and renamed into place in one go) so a half built store is never picked up
+        with open(meta_path + '.tmp', 'w') as f:
+            json.dump(meta, f)
+        os.replace(meta_path + '.tmp', meta_path)
+        self._meta = meta
+        self._arrays = {}
+
+    def load(self, filename, fromDate=None, toDate=None, columns=None):
+        """
+        Loads one file from the store, the result is identical to reading, reversing and date slicing the csv.
+        :param filename: The csv filename the data came from
+        :param fromDate: The first date to include (as a string, like the csv slicing)
+        :param toDate: The last date to include
+        :param columns: Only load these columns, defaults to all of them
+        :return: DataFrame indexed by date
+        """
+        entry = self.meta['entries'][filename]
+        start, stop = entry['start'], entry['stop']
+        dates = self._array('date')[start:stop]
+        # Same semantics as slicing the string index of the csv DataFrame
+        lo = 0 if fromDate is None else np.searchsorted(dates, fromDate.encode(), side='left')
+        hi = len(dates) if toDate is None else np.searchsorted(dates, toDate.encode(), side='right')
+        all_columns = self.meta['columns']
+        if columns is None:
+            columns = all_columns
+        data = {}
+        for col in columns:
+            i = all_columns.index(col)
+            data[col] = self._array('col{}'.format(i))[start + lo:start + hi].astype(entry['dtypes'][i])
+        index = pd.Index(dates[lo:hi].astype(str).astype(object), name=self.meta['index_name'])
+        return pd.DataFrame(data, index=index, columns=columns)
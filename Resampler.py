@@ -0,0 +1,176 @@
+import numpy as np
+import pandas as pd
+from utils import to_datetime64
+
+"""
+Turns daily bars into weekly, monthly or N-day bars for the whole universe in one go. Every ticker's rows are put end
+to end, the rows where a new bar starts are found once (a new calendar period, or a new ticker) and each column is
+reduced between those boundaries with numpy's reduceat, rather than a pandas groupby per ticker.
+
+A rule is 'week' (Monday to Sunday), 'month' or an int N for bars of N trading days counted from each ticker's first
+row. Bars are labelled with the date of the last day in them.
+"""
+
+
+# How each column is combined into a bar, anything not listed takes the last value
+AGGREGATIONS = {'open': 'first', 'high': 'max', 'low': 'min', 'close': 'last', 'adjusted_close': 'last',
+                'volume': 'sum', 'dividend_amount': 'sum', 'split_coefficient': 'prod'}
+CALENDAR_RULES = ('week', 'month')
+
+
+def _check_rule(rule):
+    if rule in CALENDAR_RULES:
+        return
+    if isinstance(rule, (int, np.integer)) and not isinstance(rule, bool) and rule > 0:
+        return
+    raise ValueError("Unknown resample rule {}, use 'week', 'month' or a number of days".format(rule))
+
+
+def period_keys(dates, rule):
+    """
+    :param dates: datetime64[D] array
+    :param rule: 'week' or 'month'
+    :return: int array numbering the calendar period each date is in
+    """
+    if rule == 'week':
+        # 1970-01-01 was a Thursday, shifting by 3 days makes the weeks start on a Monday
+        return (dates.astype(np.int64) + 3) // 7
+    return dates.astype('datetime64[M]').astype(np.int64)
+
+
+def period_bounds(keys, rule):
+    """
+    :return: The first and last day (datetime64[D] arrays) of the periods numbered by period_keys
+    """
+    if rule == 'week':
+        first = (keys * 7 - 3).astype('datetime64[D]')
+        return first, first + np.timedelta64(6, 'D')
+    first = keys.astype('datetime64[M]').astype('datetime64[D]')
+    last = (keys + 1).astype('datetime64[M]').astype('datetime64[D]') - np.timedelta64(1, 'D')
+    return first, last
+
+
+def _dates(df):
+    return np.asarray(df['date'] if 'date' in df.columns else df.index)
+
+
+def _spans(days, offsets, lengths):
+    """
+    The first and last day of each ticker, NaT for tickers with no rows
+    """
+    has_rows = lengths > 0
+    first_day = np.full(len(lengths), np.datetime64('NaT'), dtype='datetime64[D]')
+    last_day = first_day.copy()
+    first_day[has_rows] = days[offsets[has_rows]]
+    last_day[has_rows] = days[offsets[has_rows] + lengths[has_rows] - 1]
+    return first_day, last_day
+
+
+def _complete(keys, owner, rule, fromDate, toDate, first_day, last_day):
+    """
+    Which calendar bars cover their whole period: the weekdays of the period have to lie inside fromDate to toDate,
+    or each ticker's own first and last day when they aren't given. Weekends don't count, so a week loaded up to its
+    Friday (or a month ending on a Sunday loaded up to its last Friday) is complete
+    """
+    start, end = period_bounds(keys, rule)
+    start = np.busday_offset(start, 0, roll='forward')
+    end = np.busday_offset(end, 0, roll='backward')
+    lo = np.datetime64(fromDate, 'D') if fromDate is not None else first_day[owner]
+    hi = np.datetime64(toDate, 'D') if toDate is not None else last_day[owner]
+    return (start >= lo) & (end <= hi)
+
+
+def _split(data_dict, owner, labels, columns):
+    """
+    Cuts the bars of every ticker (in ticker order, owner giving each bar's ticker) back into a {tckr: DataFrame}
+    """
+    tickers = list(data_dict.keys())
+    edges = np.cumsum(np.bincount(owner, minlength=len(tickers)))[:-1]
+    labels = np.split(labels, edges)
+    columns = {col: np.split(values, edges) for col, values in columns.items()}
+    resampled = {}
+    for i, (tckr, df) in enumerate(data_dict.items()):
+        data = {col: values[i] for col, values in columns.items()}
+        if 'date' in df.columns:
+            resampled[tckr] = pd.DataFrame(dict({'date': labels[i]}, **data), columns=df.columns, copy=False)
+        else:
+            resampled[tckr] = pd.DataFrame(data, index=pd.Index(labels[i], name=df.index.name), columns=df.columns,
+                                           copy=False)
+    return resampled
+
+
+def resample(data_dict, rule='week', fromDate=None, toDate=None, complete=True):
+    """
+    Resamples every ticker of a {tckr: data} dictionary (as loaded, or with a 'date' column) at once.
+    :param rule: 'week', 'month' or an int N for bars of N trading days
+    :param fromDate: The first date the data was loaded from, used to tell if the first period is complete
+    :param toDate: The last date the data was loaded to
+    :param complete: Drop the bars that don't cover their whole period, i.e. the calendar periods sticking out of
+                     fromDate-toDate and for N-day bars a last bar of fewer than N days
+    :return: {tckr: resampled data} in the same layout
+    """
+    _check_rule(rule)
+    if not data_dict:
+        return {}
+    frames = list(data_dict.values())
+    lengths = np.array([len(df) for df in frames], dtype=np.int64)
+    total = lengths.sum()
+    offsets = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+    owner = np.repeat(np.arange(len(frames)), lengths)
+    raw_dates = np.concatenate([_dates(df) for df in frames])
+    if rule in CALENDAR_RULES:
+        days = to_datetime64(raw_dates)
+        keys = period_keys(days, rule)
+    else:
+        keys = (np.arange(total) - np.repeat(offsets, lengths)) // rule
+    # The boundaries of every bar in the whole universe, worked out once and shared by all the columns
+    new_bar = np.ones(total, dtype=bool)
+    new_bar[1:] = (keys[1:] != keys[:-1]) | (owner[1:] != owner[:-1])
+    starts = np.flatnonzero(new_bar)
+    ends = np.append(starts[1:], total)[:len(starts)]
+    bar_owner = owner[starts]
+    if not complete or total == 0:
+        keep = np.ones(len(starts), dtype=bool)
+    elif rule in CALENDAR_RULES:
+        keep = _complete(keys[starts], bar_owner, rule, fromDate, toDate, *_spans(days, offsets, lengths))
+    else:
+        keep = ends - starts == rule
+    columns = {}
+    for col in frames[0].columns:
+        if col == 'date':
+            continue
+        values = np.concatenate([df[col].to_numpy() for df in frames])
+        how = AGGREGATIONS.get(col, 'last')
+        if total == 0:
+            columns[col] = values
+        elif how == 'first':
+            columns[col] = values[starts]
+        elif how == 'last':
+            columns[col] = values[ends - 1]
+        else:
+            ufunc = {'max': np.maximum, 'min': np.minimum, 'sum': np.add, 'prod': np.multiply}[how]
+            columns[col] = ufunc.reduceat(values, starts)
+        columns[col] = columns[col][keep]
+    return _split(data_dict, bar_owner[keep], raw_dates[ends - 1][keep], columns)
+
+
+def complete_bars(data_dict, rule, fromDate=None, toDate=None):
+    """
+    Drops the bars of already resampled data (e.g. from a resampled PriceStore, built over the whole history) whose
+    calendar period isn't entirely inside fromDate-toDate. Gives the same bars as resampling the daily data
+    between those dates with complete=True
+    """
+    if rule not in CALENDAR_RULES:
+        raise ValueError("Only 'week' and 'month' bars can be checked for completeness after resampling")
+    if not data_dict:
+        return {}
+    frames = list(data_dict.values())
+    lengths = np.array([len(df) for df in frames], dtype=np.int64)
+    owner = np.repeat(np.arange(len(frames)), lengths)
+    raw_dates = np.concatenate([_dates(df) for df in frames])
+    days = to_datetime64(raw_dates)
+    offsets = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+    keep = _complete(period_keys(days, rule), owner, rule, fromDate, toDate, *_spans(days, offsets, lengths))
+    columns = {col: np.concatenate([df[col].to_numpy() for df in frames])[keep]
+               for col in frames[0].columns if col != 'date'}
+    return _split(data_dict, owner[keep], raw_dates[keep], columns)
@@ -0,0 +1,51 @@
+import numpy as np
+
+
+def run_signals(long_entry, short_entry, exit_signal, close, next_open, stop_loss_perc=None):
+    """
+    The open/close state machine every strategy runs, on plain arrays rather than DataFrame rows. Instead of
+    stepping through every row it jumps straight to the next row that can change the state: the next entry when no
+    position is open, the next exit signal or stop loss hit when one is.
+    The rules are the same as the old row by row loops: with no position open, a short is opened on a short entry,
+    otherwise a long on a long entry. With a position open (from the row after it was opened) it is closed on an exit
+    signal or, if stop_loss_perc is given, when the close crosses the stop price. Prices are the next day's open.
+    :param long_entry: bool array, rows where a long can be opened
+    :param short_entry: bool array, rows where a short can be opened (checked before long_entry)
+    :param exit_signal: bool array, rows where an open position is closed
+    :param close: the close prices, used for the stop loss
+    :param next_open: the next day's open, which is the entry price
+    :param stop_loss_perc: The stop loss as a fraction of the entry price, None for no stop loss
+    :return: open_signal, close_signal (arrays of -1/0/1 like the strategies store) and the trades as a list of
+             (open row, close row or None if it is still open, direction)
+    """
+    n = len(close)
+    direction = np.where(short_entry, -1, np.where(long_entry, 1, 0))
+    open_signal = np.zeros(n)
+    close_signal = np.zeros(n)
+    entries = np.flatnonzero(direction)
+    exits = np.flatnonzero(exit_signal)
+    trades = []
+    start = 0
+    while True:
+        k = np.searchsorted(entries, start)
+        if k == len(entries):
+            break
+        opened = entries[k]
+        pos = direction[opened]
+        open_signal[opened] = pos
+        # Closing is only looked at from the row after the open
+        j = np.searchsorted(exits, opened + 1)
+        closed = exits[j] if j < len(exits) else n
+        if stop_loss_perc is not None:
+            stop_price = (1 - pos * stop_loss_perc) * next_open[opened]
+            with np.errstate(invalid='ignore'):
+                stopped = pos * close[opened + 1:closed] < pos * stop_price
+            if stopped.any():
+                closed = opened + 1 + np.argmax(stopped)
+        if closed >= n:
+            trades.append((opened, None, pos))
+            break
+        close_signal[closed] = pos
+        trades.append((opened, closed, pos))
+        start = closed + 1
+    return open_signal, close_signal, trades
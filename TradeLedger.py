@@ -0,0 +1,152 @@
+import numpy as np
+import pandas as pd
+from utils import to_days, date_str
+
+
+class _Columns:
+    """
+    A set of equal length typed numpy arrays which double in size when full, so appending a row is O(1)
+    """
+    def __init__(self, dtypes, capacity=64):
+        self.dtypes = dtypes
+        self.size = 0
+        self.arrays = {name: np.empty(capacity, dtype=dtype) for name, dtype in dtypes.items()}
+
+    def append(self, **values):
+        if self.size == len(next(iter(self.arrays.values()))):
+            for name, array in self.arrays.items():
+                grown = np.empty(2 * len(array), dtype=array.dtype)
+                grown[:self.size] = array[:self.size]
+                self.arrays[name] = grown
+        for name, value in values.items():
+            self.arrays[name][self.size] = value
+        self.size += 1
+
+    def __getitem__(self, name):
+        return self.arrays[name][:self.size]
+
+    def load(self, arrays):
+        """
+        Replaces the contents with arrays of the filled rows, i.e. what __getitem__ gives back
+        """
+        self.size = len(next(iter(arrays.values())))
+        capacity = max(64, self.size)
+        for name, dtype in self.dtypes.items():
+            self.arrays[name] = np.empty(capacity, dtype=dtype)
+            self.arrays[name][:self.size] = arrays[name]
+
+
+class TradeLedger:
+    """
+    Records the transactions and the returns of a strategy. Replaces appending a row to a DataFrame for every trade
+    (which copies the whole DataFrame each time) with typed arrays. Symbols and dates are stored as ids into lookup
+    lists. The DataFrames are only built when trans_df/rets_df are asked for.
+    The days each trade was held aren't worked out per trade, they come from the date ids in one go in days_held.
+    """
+    def __init__(self):
+        self.symbols = []
+        self.dates = []
+        self._symbol_ids = {}
+        self._date_ids = {}
+        self.trans = _Columns({'symbol': np.int32, 'date': np.int32, 'direction': np.int8, 'close': np.int8,
+                               'price': np.float64})
+        self.rets = _Columns({'symbol': np.int32, 'entry_date': np.int32, 'close_date': np.int32,
+                              'direction': np.int8, 'entry_price': np.float64, 'close_price': np.float64,
+                              'return': np.float64})
+        # Day number of each date in self.dates, filled in as needed
+        self._days = np.empty(0)
+        self._trans_df = None
+        self._rets_df = None
+
+    def _symbol_id(self, symbol):
+        try:
+            return self._symbol_ids[symbol]
+        except KeyError:
+            self._symbol_ids[symbol] = len(self.symbols)
+            self.symbols.append(symbol)
+            return self._symbol_ids[symbol]
+
+    def _date_id(self, date):
+        try:
+            return self._date_ids[date]
+        except KeyError:
+            pass
+        # Lean data has datetime64 dates, they are stored as the same strings as the csv dates
+        key = date_str(date)
+        if key not in self._date_ids:
+            self._date_ids[key] = len(self.dates)
+            self.dates.append(key)
+        self._date_ids[date] = self._date_ids[key]
+        return self._date_ids[key]
+
+    def add_transaction(self, symbol, date, direction, close, price):
+        self.trans.append(symbol=self._symbol_id(symbol), date=self._date_id(date), direction=direction, close=close,
+                          price=price)
+        self._trans_df = None
+
+    def add_return(self, symbol, entry_date, close_date, direction, entry_price, close_price, returns):
+        self.rets.append(symbol=self._symbol_id(symbol), entry_date=self._date_id(entry_date),
+                         close_date=self._date_id(close_date), direction=direction, entry_price=entry_price,
+                         close_price=close_price, **{'return': returns})
+        self._rets_df = None
+
+    def days_held(self):
+        """
+        :return: float array of the days between the entry and close date of each trade, NaN if not dates
+        """
+        if len(self._days) < len(self.dates):
+            # Only the dates added since last time need converting
+            self._days = np.concatenate([self._days, to_days(self.dates[len(self._days):])])
+        return self._days[self.rets['close_date']] - self._days[self.rets['entry_date']]
+
+    def _lookup(self, values, ids):
+        return np.array(values, dtype=object)[ids] if len(ids) else np.array([], dtype=object)
+
+    @property
+    def trans_df(self):
+        if self._trans_df is None:
+            self._trans_df = pd.DataFrame({
+                'symbol': self._lookup(self.symbols, self.trans['symbol']),
+                'date': self._lookup(self.dates, self.trans['date']),
+                'direction': self.trans['direction'].astype(np.int64),
+                'close': self.trans['close'].astype(np.int64),
+                'price': self.trans['price'].copy()})
+        return self._trans_df
+
+    @property
+    def rets_df(self):
+        if self._rets_df is None:
+            self._rets_df = pd.DataFrame({
+                'symbol': self._lookup(self.symbols, self.rets['symbol']),
+                'entry_date': self._lookup(self.dates, self.rets['entry_date']),
+                'close_date': self._lookup(self.dates, self.rets['close_date']),
+                'days_held': self.days_held(),
+                'direction': self.rets['direction'].astype(np.int64),
+                'entry_price': self.rets['entry_price'].copy(),
+                'close_price': self.rets['close_price'].copy(),
+                'return': self.rets['return'].copy()})
+        return self._rets_df
+
+    def to_arrays(self):
+        """
+        The contents as a flat dict of arrays (e.g. for np.savez), see from_arrays
+        """
+        arrays = {'symbols': np.array(self.symbols, dtype=str), 'dates': np.array(self.dates, dtype=str)}
+        for prefix, columns in (('trans_', self.trans), ('rets_', self.rets)):
+            for name in columns.dtypes:
+                arrays[prefix + name] = columns[name]
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        ledger = cls()
+        ledger.symbols = [str(symbol) for symbol in arrays['symbols']]
+        ledger.dates = [str(date) for date in arrays['dates']]
+        ledger._symbol_ids = {symbol: i for i, symbol in enumerate(ledger.symbols)}
+        ledger._date_ids = {date: i for i, date in enumerate(ledger.dates)}
+        for prefix, columns in (('trans_', ledger.trans), ('rets_', ledger.rets)):
+            columns.load({name: arrays[prefix + name] for name in columns.dtypes})
+        return ledger
+
+    def __len__(self):
+        return self.rets.size
@@ -0,0 +1,159 @@
+import numpy as np
+import pandas as pd
+from utils import add_time, date_str, worker_pool, worker_state
+from Analyzer import Analyzer
+from Optimizer import GridSearch, indicated, score
+
+
+class WalkForward:
+    """
+    Walk-forward optimisation. Rather than picking the parameters on one fixed window (which overfits) it rolls an
+    in-sample window across history, picks the best parameters of the grid on it and then trades them on the
+    out-of-sample window straight after. The out-of-sample trades of every window stitched together show how the
+    strategy would really have done.
+    The data is loaded once and sliced per window. The indicators of each parameter group are computed once over the
+    whole history and then sliced too, so each window starts with the indicator state carried over from the one
+    before instead of warming up again.
+    Positions still open at the end of an out-of-sample window are closed on its last day (at the next open, or the
+    close if there isn't one) so every window's trades are its own. The windows can't overlap, the step has to be
+    at least the out-of-sample length, otherwise the same days would be traded (and counted in equity) twice.
+    """
+    def __init__(self, strat, data, param_grid, params=None, in_sample=None, out_sample=None, step=None,
+                 fromDate=None, toDate=None, objective='returns', workers=1):
+        """
+        :param strat: The strategy as a class i.e. just as BBStopLoss not as BBStopLoss(data, params)
+        :param data: Prepared data covering the whole history
+        :param param_grid: {param name: list of values to try} on each in-sample window
+        :param params: Parameters kept the same for every combination
+        :param in_sample: Length of the in-sample window as add_time arguments, defaults to {'year': 2}
+        :param out_sample: Length of the out-of-sample window, defaults to {'month': 6}
+        :param step: How far to move the windows each time, defaults to out_sample. Can't be shorter than out_sample
+        :param fromDate: Start of the first in-sample window, defaults to the first date in the data
+        :param toDate: No out-of-sample window starts after this, defaults to the last date in the data
+        :param objective: What the in-sample windows are optimised for, see Optimizer.score
+        :param workers: Number of processes to spread the windows over
+        """
+        self.strat = strat
+        self.data = data
+        self.grid = GridSearch(strat, data, param_grid, params=params, objective=objective)
+        self.in_sample = in_sample if in_sample is not None else {'year': 2}
+        self.out_sample = out_sample if out_sample is not None else {'month': 6}
+        self.step = step if step is not None else self.out_sample
+        all_dates = np.concatenate([df['date'].values for df in data.values()])
+        self.fromDate = fromDate if fromDate is not None else date_str(min(all_dates))
+        if add_time(self.fromDate, **self.step) < add_time(self.fromDate, **self.out_sample):
+            raise ValueError("step {} is shorter than out_sample {}, the out-of-sample windows would overlap".format(
+                self.step, self.out_sample))
+        self.toDate = toDate if toDate is not None else date_str(max(all_dates))
+        self.objective = objective
+        self.workers = workers
+        self.results = None
+        self.trades = None
+        self.equity = None
+
+    def windows(self):
+        """
+        :return: list of (in-sample start, in-sample end, out-of-sample start, out-of-sample end). Starts are
+                 inclusive, ends exclusive
+        """
+        windows = []
+        start = self.fromDate
+        while True:
+            in_end = add_time(start, **self.in_sample)
+            out_end = add_time(in_end, **self.out_sample)
+            if in_end > self.toDate:
+                break
+            windows.append((start, in_end, in_end, out_end))
+            start = add_time(start, **self.step)
+        return windows
+
+    def run(self):
+        """
+        Runs every window
+        :return: DataFrame with a row per window: its dates, the chosen params and the in and out-of-sample scores.
+                 The stitched out-of-sample trades are kept in self.trades and the equity curve (cumulative returns
+                 by close date) in self.equity
+        """
+        groups = self.grid.groups()
+        windows = self.windows()
+        if self.workers is None or self.workers <= 1 or len(windows) <= 1:
+            cache = {}
+            results = [_run_window(self.strat, self.data, groups, window, self.objective, cache)
+                       for window in windows]
+        else:
+            # The data is sent to each worker once, each worker then keeps the indicators it has computed
+            with worker_pool(self.workers, {'strat': self.strat, 'data': self.data, 'groups': groups,
+                                            'objective': self.objective, 'cache': {}}) as executor:
+                results = list(executor.map(_run_window_in_worker, windows))
+        self.results = pd.DataFrame([{key: value for key, value in result.items() if key != 'trades'}
+                                     for result in results])
+        trades = [result['trades'] for result in results]
+        self.trades = pd.concat(trades, ignore_index=True) if trades else pd.DataFrame()
+        if len(self.trades):
+            self.equity = self.trades.groupby('close_date')['return'].sum().cumsum()
+        else:
+            self.equity = pd.Series(dtype=np.float64)
+        return self.results
+
+
+def _slice(data, start, end):
+    """
+    The rows of each ticker from start (inclusive) to end (exclusive). The slices keep the indicators
+    """
+    sliced = {}
+    for tckr, df in data.items():
+        dates = df['date'].values
+        # The window dates are strings, lean data has datetime64 dates
+        first, last = np.array([start, end], dtype=dates.dtype)
+        sliced[tckr] = df.iloc[np.searchsorted(dates, first):np.searchsorted(dates, last)].reset_index(drop=True)
+    return sliced
+
+
+def _run_window(strat, data, groups, window, objective, cache):
+    """
+    Picks the best params on the in-sample part of the window and trades them on the out-of-sample part
+    """
+    in_start, in_end, out_start, out_end = window
+    best = None
+    best_score = None
+    for group in groups:
+        train = _slice(indicated(strat, data, group[0], cache), in_start, in_end)
+        for combo in group:
+            in_score = score(Analyzer(strat(train, combo)), objective)
+            if best is None or in_score > best_score:
+                best = combo
+                best_score = in_score
+    test = strat(_slice(indicated(strat, data, best, cache), out_start, out_end), best)
+    test.run()
+    _close_open_positions(test)
+    analyzer = Analyzer(test, run=False)
+    trades = test.rets_df.copy()
+    trades.insert(loc=0, column='window', value=out_start)
+    return {'in_sample_start': in_start, 'in_sample_end': in_end, 'out_sample_start': out_start,
+            'out_sample_end': out_end, 'params': best, 'in_sample_score': best_score,
+            'out_sample_score': score(analyzer, objective), 'trades': trades}
+
+
+def _close_open_positions(strategy):
+    """
+    Closes the positions left open at the end of the strategy's data on the last day, at the next open or the close
+    when there's no next open (the end of the history)
+    """
+    trans = strategy.trans_df
+    if not len(trans):
+        return
+    last = trans.groupby('symbol', sort=False).tail(1)
+    for _, opened in last[last['close'] == 0].iterrows():
+        data = strategy.portfolio[opened['symbol']]
+        price = data['next_open'].values[-1]
+        if np.isnan(price):
+            price = data['close'].values[-1]
+        strategy.open_pos = opened['direction']
+        strategy.entry_date = opened['date']
+        strategy.entry_price = opened['price']
+        strategy._close_pos(opened['symbol'], {'date': data['date'].values[-1], 'next_open': price})
+
+
+def _run_window_in_worker(window):
+    state = worker_state()
+    return _run_window(state['strat'], state['data'], state['groups'], window, state['objective'], state['cache'])
@@ -0,0 +1,67 @@
+"""
+Measures the cold start cost of importing a strategy, which every worker process of a parallel run pays.
+Each run is a fresh interpreter with python -X importtime, the total is the cumulative time of the top level import.
+Usage: python benchmarks/import_time.py [--statement "from BBStopLoss import BBStopLoss"] [--runs 5] [--json out.json]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Only needed for plotting or fetching data, shouldn't be loaded by a plain import
+HEAVY = ('matplotlib', 'mplfinance', 'bs4', 'requests')
+
+
+def measure(statement):
+    """
+    :return: (total microseconds, {module: cumulative microseconds}, heavy modules that got loaded)
+    """
+    check = "{}\nimport sys\nprint(','.join(m for m in {!r} if m in sys.modules))".format(statement, HEAVY)
+    output = subprocess.run([sys.executable, '-X', 'importtime', '-c', check], cwd=ROOT, capture_output=True,
+                            text=True, check=True)
+    modules = {}
+    for line in output.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        modules[name.strip()] = int(cumulative)
+    # The last line is the module the statement imported, its cumulative time covers everything it pulled in
+    last = output.stderr.strip().splitlines()[-1]
+    total = int(last.split('|')[1])
+    loaded = [name for name in output.stdout.strip().split(',') if name]
+    return total, modules, loaded
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--statement', default='from BBStopLoss import BBStopLoss')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=10)
+    parser.add_argument('--json', help='Also write the results to this file')
+    args = parser.parse_args()
+
+    totals = []
+    for _ in range(args.runs):
+        total, modules, loaded = measure(args.statement)
+        totals.append(total)
+    top = sorted(((cumulative, name) for name, cumulative in modules.items() if '.' not in name),
+                 reverse=True)[:args.top]
+    result = {'statement': args.statement, 'runs': args.runs, 'median_ms': statistics.median(totals) / 1000,
+              'min_ms': min(totals) / 1000, 'top_level_ms': {name: cumulative / 1000 for cumulative, name in top},
+              'heavy_modules_loaded': loaded}
+    print("{}: median {:.1f} ms, min {:.1f} ms over {} runs".format(args.statement, result['median_ms'],
+                                                                   result['min_ms'], args.runs))
+    for name, ms in result['top_level_ms'].items():
+        print("  {:<30} {:8.1f} ms".format(name, ms))
+    if loaded:
+        print("Heavy modules loaded: {}".format(', '.join(loaded)))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
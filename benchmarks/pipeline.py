@@ -0,0 +1,127 @@
+"""
+Times each stage of a backtest on synthetic data: loading a sector (get_one_sector_SP), prepare_data, the indicators
+(building the strategy), run, Analyzer.get_returns and MCAnalyze.run_MC, for every combination of universe size and
+history length. Each case is run once for the timings and, unless --no-memory, once more under tracemalloc for the
+peak memory of each stage (tracing slows everything down so the two aren't mixed).
+Usage: python benchmarks/pipeline.py --tickers 10 50 --years 2 5 --json results.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import numpy as np
+import pandas as pd
+from synthetic import write_universe
+from DataManager import DataManager
+from BBStopLoss import BBStopLoss
+from Analyzer import Analyzer
+from MCAnalyze import MCAnalyze
+
+
+class _Stages:
+    """
+    Times (or traces the memory of) each stage of a case
+    """
+    def __init__(self, trace):
+        self.trace = trace
+        self.results = {}
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        if self.trace:
+            tracemalloc.reset_peak()
+            start_bytes = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        # The stages print progress, keep the benchmark output clean
+        with contextlib.redirect_stdout(io.StringIO()):
+            yield
+        elapsed = time.perf_counter() - start
+        if self.trace:
+            self.results[name] = tracemalloc.get_traced_memory()[1] - start_bytes
+        else:
+            self.results[name] = elapsed
+
+
+def run_case(path, fromDate, toDate, params, mc_iterations, use_store, trace):
+    stages = _Stages(trace)
+    if use_store:
+        with stages.stage('ingest'):
+            dm = DataManager(path_to_data=path, path_to_store=os.path.join(path, 'store'))
+            dm.ingest_SP()
+    else:
+        dm = DataManager(path_to_data=path)
+    with stages.stage('load'):
+        data = dm.get_one_sector_SP(sector='Energy', fromDate=fromDate, toDate=toDate)
+    with stages.stage('prepare'):
+        data = dm.prepare_data(data)
+    with stages.stage('indicators'):
+        strat = BBStopLoss(data, params)
+    with stages.stage('run'):
+        strat.run()
+    with stages.stage('analyze'):
+        Analyzer(strat, run=False).get_returns()
+    if mc_iterations:
+        # The strategy above didn't add anything to data, so the Monte Carlo gets the plain prices
+        with stages.stage('monte_carlo'):
+            MCAnalyze(BBStopLoss, data, params).run_MC(mc_iterations, seed=0)
+    return stages.results, len(data), sum(len(df) for df in data.values()), len(strat.rets_df)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--tickers', type=int, nargs='+', default=[10, 50])
+    parser.add_argument('--years', type=int, nargs='+', default=[2, 5])
+    parser.add_argument('--mc-iterations', type=int, default=10, help='0 to skip the Monte Carlo stage')
+    parser.add_argument('--store', action='store_true', help='Ingest into a PriceStore and load from that')
+    parser.add_argument('--no-memory', action='store_true', help="Don't do the tracemalloc pass")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help='Write the results to this file as well as printing them')
+    args = parser.parse_args()
+
+    params = {'stop_loss_perc': 0.1}
+    report = {'python': platform.python_version(), 'numpy': np.__version__, 'pandas': pd.__version__,
+              'platform': platform.platform(), 'store': args.store, 'cases': []}
+    for tickers in args.tickers:
+        for years in args.years:
+            path = tempfile.mkdtemp(prefix='bb_bench_')
+            try:
+                fromDate, toDate = write_universe(path, tickers, 252 * years, seed=args.seed)
+                seconds, kept, rows, trades = run_case(path + os.sep, fromDate, toDate, params,
+                                                       args.mc_iterations, args.store, trace=False)
+                peaks = {}
+                if not args.no_memory:
+                    # A fresh store so the ingest is traced as well
+                    shutil.rmtree(os.path.join(path, 'store'), ignore_errors=True)
+                    tracemalloc.start()
+                    peaks = run_case(path + os.sep, fromDate, toDate, params, args.mc_iterations, args.store,
+                                     trace=True)[0]
+                    tracemalloc.stop()
+            finally:
+                shutil.rmtree(path, ignore_errors=True)
+            case = {'tickers': tickers, 'years': years, 'tickers_kept': kept, 'rows': rows, 'trades': trades,
+                    'total_seconds': sum(seconds.values()),
+                    'stages': {name: {'seconds': seconds[name], 'peak_bytes': peaks.get(name)} for name in seconds}}
+            report['cases'].append(case)
+            print("{} tickers x {} years ({} rows, {} trades): {:.2f}s".format(tickers, years, rows, trades,
+                                                                              case['total_seconds']))
+            for name, stage in case['stages'].items():
+                memory = '' if stage['peak_bytes'] is None else ' {:10.1f} MB'.format(stage['peak_bytes'] / 1024 ** 2)
+                print("  {:<12} {:8.3f}s{}".format(name, stage['seconds'], memory))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+"""
+Deterministic synthetic price data in the same layout as the saved S&P files, so the benchmarks don't need the real
+data. Each file is <SYMBOL><sector number>.csv with the columns ,timestamp,open,high,low,close,adjusted_close,volume,
+dividend_amount,split_coefficient and the newest date first, like the files DataManager reads.
+"""
+import os
+import numpy as np
+import pandas as pd
+
+
+def symbol_name(i):
+    """
+    AAA, AAB, ... so the names are letters only like the real tickers
+    """
+    letters = ''
+    for _ in range(3):
+        letters = chr(ord('A') + i % 26) + letters
+        i //= 26
+    return letters
+
+
+def make_prices(days, rng, start_price=50.0, drift=0.0002, volatility=0.02):
+    """
+    One random walk of open/high/low/close/volume
+    """
+    close = start_price * np.exp(np.cumsum(rng.normal(drift, volatility, days)))
+    open_prices = close * (1 + rng.normal(0, volatility / 4, days))
+    high = np.maximum(open_prices, close) * (1 + np.abs(rng.normal(0, volatility / 2, days)))
+    low = np.minimum(open_prices, close) * (1 - np.abs(rng.normal(0, volatility / 2, days)))
+    volume = rng.integers(100000, 5000000, days)
+    return open_prices, high, low, close, volume
+
+
+def write_universe(path, tickers, days, sector=3, start='2000-01-03', seed=0):
+    """
+    Writes tickers files of days business days each
+    :param path: Folder to write them to
+    :param sector: Sector number in the filenames, see DataManager.categoryList (3 is Energy)
+    :param seed: Same seed gives the same files
+    :return: (first date, last date) of the data
+    """
+    os.makedirs(path, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    dates = pd.bdate_range(start, periods=days).strftime('%Y-%m-%d')
+    for i in range(tickers):
+        open_prices, high, low, close, volume = make_prices(days, rng, start_price=rng.uniform(10, 200))
+        df = pd.DataFrame({'timestamp': dates, 'open': open_prices.round(4), 'high': high.round(4),
+                           'low': low.round(4), 'close': close.round(4), 'adjusted_close': close.round(4),
+                           'volume': volume, 'dividend_amount': 0.0, 'split_coefficient': 1.0})
+        # Newest first like the downloaded files
+        df.iloc[::-1].reset_index(drop=True).to_csv(os.path.join(path, '{}{}.csv'.format(symbol_name(i), sector)))
+    return dates[0], dates[-1]
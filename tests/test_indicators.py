@@ -0,0 +1,31 @@
+import os
+import sys
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Indicators import rolling_mean, rolling_std
+
+
+def _trending(n=6300, growth=2000, noise=0.002, seed=0):
+    # About 25 years of daily prices rising ~2000x, so the early windows are tiny next to the later prices
+    rng = np.random.default_rng(seed)
+    return np.exp(np.linspace(0, np.log(growth), n)) * (1 + rng.normal(0, noise, n))
+
+
+def test_rolling_std_matches_pandas_on_a_strong_trend():
+    prices = _trending()
+    for window in (20, 125):
+        expected = pd.Series(prices).rolling(window).std().to_numpy()
+        got = rolling_std(prices, window)[:, 0]
+        assert np.array_equal(np.isnan(got), np.isnan(expected))
+        np.testing.assert_allclose(got, expected, rtol=1e-8)
+
+
+def test_rolling_mean_matches_pandas_with_gaps():
+    prices = _trending(seed=1)
+    prices[[100, 2500, 2510]] = np.nan
+    expected = pd.Series(prices).rolling(20).mean().to_numpy()
+    got = rolling_mean(prices, 20)[:, 0]
+    assert np.array_equal(np.isnan(got), np.isnan(expected))
+    np.testing.assert_allclose(got, expected, rtol=1e-9)
@@ -0,0 +1,46 @@
+import os
+import sys
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Resampler import resample, complete_bars
+
+
+def _daily(fromDate, toDate):
+    dates = pd.bdate_range(fromDate, toDate).strftime('%Y-%m-%d')
+    n = len(dates)
+    return pd.DataFrame({'open': np.arange(n, dtype=float), 'high': np.arange(n) + 1.0, 'low': np.arange(n) - 1.0,
+                         'close': np.arange(n) + 0.5, 'volume': np.ones(n, dtype=np.int64),
+                         'split_coefficient': np.ones(n)}, index=pd.Index(dates, name='timestamp'))
+
+
+def test_week_loaded_to_a_friday_is_complete():
+    # 2003-05-30 is a Friday, the week of 5/26 - 5/30 is all there
+    data = {'A': _daily('2003-05-01', '2003-05-30')}
+    weekly = resample(data, 'week', '2003-05-01', '2003-05-30')['A']
+    assert weekly.index[-1] == '2003-05-30'
+    assert weekly['volume'].iloc[-1] == 5
+    # but not when it stops on the Thursday
+    weekly = resample({'A': _daily('2003-05-01', '2003-05-29')}, 'week', '2003-05-01', '2003-05-29')['A']
+    assert weekly.index[-1] == '2003-05-23'
+
+
+def test_month_ending_on_a_weekend_is_complete():
+    # August 2003 ends on a Sunday, its last weekday is Friday the 29th
+    data = {'A': _daily('2003-07-01', '2003-08-29')}
+    monthly = resample(data, 'month', '2003-07-01', '2003-08-29')['A']
+    assert list(monthly.index) == ['2003-07-31', '2003-08-29']
+    # November 2003 starts on a Saturday, loading from its first weekday still gives the whole month
+    monthly = resample({'A': _daily('2003-11-03', '2003-11-28')}, 'month', '2003-11-03', '2003-11-28')['A']
+    assert list(monthly.index) == ['2003-11-28']
+
+
+def test_stored_bars_match_resampling_the_slice():
+    daily = _daily('2003-01-01', '2003-12-31')
+    full = resample({'A': daily}, 'week', complete=False)['A']
+    stored = complete_bars({'A': full[(full.index >= '2003-03-05') & (full.index <= '2003-05-30')]}, 'week',
+                           '2003-03-05', '2003-05-30')['A']
+    direct = resample({'A': daily['2003-03-05':'2003-05-30']}, 'week', '2003-03-05', '2003-05-30')['A']
+    pd.testing.assert_frame_equal(stored, direct)
+    assert stored.index[-1] == '2003-05-30'
@@ -1,6 +1,8 @@
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 from dateutil.relativedelta import relativedelta
 import numpy as np
+import pandas as pd
 
 """
 All these functions are pretty self explanatory and just take care of random bits of code that are needed
@@ -52,21 +54,105 @@ def calc_diff(starting, ending, type='days'):
         return (datetime.strptime(ending, format).year - datetime.strptime(starting, format).year) * 12 \
                + (datetime.strptime(ending, format).month - datetime.strptime(starting, format).month)
 
-def find_next_valid(data, date):
+def to_datetime64(dates):
     """
-    Finds the next valid date in dataset
-    :param data:
-    :param date:
-    :return:
+    Converts a whole array of date strings to datetime64[D] in one go instead of strptime on each one
+    :param dates: list or array of dates in the usual format (or anything numpy understands as a date)
+    :return: datetime64[D] array, anything that isn't a date becomes NaT
     """
-    correct_date = None
-    while correct_date is None:
-        try:
-            _ = data.loc[date]
-            correct_date = date
-        except KeyError:
-            date = add_time(date, day=1)
-    return correct_date
+    dates = np.asarray(dates)
+    try:
+        return dates.astype('datetime64[D]')
+    except (ValueError, TypeError):
+        return pd.to_datetime(dates.astype(object), format=format, errors='coerce').values.astype('datetime64[D]')
+
+def date_str(date):
+    """
+    Any single date (string, datetime64, Timestamp, datetime) as a string in the usual format, so dates from lean
+    data (datetime64) and from the csv files (strings) look the same in the ledger and in saved files
+    """
+    if isinstance(date, str):
+        return date
+    return str(np.datetime64(date, 'D'))
+
+def overlay(portfolio):
+    """
+    Shallow copies of every DataFrame of the {tckr: data} portfolio. They share the price arrays of the original
+    (nothing is copied) but columns added or replaced on them, like indicators and signals, only exist in the copy.
+    So the loaded data can be treated as read only and shared by any number of strategies. Write to them with
+    set_column, not data[column] = values
+    """
+    return {tckr: data.copy(deep=False) for tckr, data in portfolio.items()}
+
+def set_column(data, column, values):
+    """
+    Adds or replaces a column of an overlay without touching the arrays it shares with the original. Newer pandas
+    always gives data[column] = values a new array, but older versions (the 1.0 in requirements.txt) write into the
+    existing array in place, which is shared. Dropping the column first makes it a new column on every version
+    """
+    if column in data.columns:
+        del data[column]
+    data[column] = values
+
+def worker_pool(workers, state):
+    """
+    A ProcessPoolExecutor whose worker processes are each sent state (a dict, e.g. the data and the strategy) once
+    when they start rather than with every task. The tasks, module level functions, read it back with
+    worker_state(). Anything put in it (like a cache) stays with that worker for the following tasks
+    """
+    return ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(state,))
+
+# The state of this process when it is one of worker_pool's workers
+_worker = {}
 
+def _init_worker(state):
+    _worker.clear()
+    _worker.update(state)
 
+def worker_state():
+    return _worker
 
+def to_days(dates):
+    """
+    Dates as a float array of days since 1970, NaN for anything that isn't a date. Differences of these are days
+    """
+    dates = to_datetime64(dates)
+    return np.where(np.isnat(dates), np.nan, dates.astype(np.int64))
+
+def calc_diff_array(starting, ending, type='days'):
+    """
+    calc_diff for whole arrays of dates at once
+    :param starting: start dates
+    :param ending: end dates
+    :return: float array of the differences, NaN where either isn't a date
+    """
+    if type == 'days':
+        return to_days(ending) - to_days(starting)
+    if type == 'weeks':
+        return np.round((to_days(ending) - to_days(starting)) / 7)
+    if type == 'months':
+        start = to_datetime64(starting).astype('datetime64[M]')
+        end = to_datetime64(ending).astype('datetime64[M]')
+        return np.where(np.isnat(start) | np.isnat(end), np.nan, (end - start).astype(np.int64))
+
+def find_next_valid(data, date):
+    """
+    Finds the next valid date in dataset, the date itself if it is in the index otherwise the first one after it.
+    A binary search of the index (which has to be sorted) rather than trying a day at a time
+    :param data: DataFrame indexed by date
+    :param date: The date to start from
+    :return: The date, None if there isn't one
+    """
+    position = data.index.searchsorted(date)
+    return data.index[position] if position < len(data.index) else None
+
+def find_next_valid_batch(data, dates):
+    """
+    find_next_valid for a whole array of dates at once
+    :return: object array of the dates, None where there isn't one
+    """
+    positions = np.asarray(data.index.searchsorted(dates))
+    found = positions < len(data.index)
+    result = np.full(len(positions), None, dtype=object)
+    result[found] = np.asarray(data.index)[positions[found]]
+    return result